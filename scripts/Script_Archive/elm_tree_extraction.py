@@ -1,11 +1,15 @@
 """ELM/Decision tree-based extraction (renamed from 20_extract_elm_tree_final.py).
 """
 
+import hashlib
 import os
+import shelve
+import time
 import networkx as nx
+from typing import Literal, Optional
 from openai import OpenAI
+from pydantic import BaseModel, Field
 from elm.base import ApiBase
-from elm.tree import DecisionTree
 from sklearn import tree
 from dotenv import load_dotenv
 
@@ -14,12 +18,40 @@ load_dotenv()
 
 client = OpenAI()
 
+# Uploaded files, keyed by content hash, so re-running on the same image
+# reuses its file_id instead of uploading (and paying for) the bytes again.
+UPLOAD_CACHE = os.environ.get("UPLOAD_CACHE_PATH", "/tmp/upload_cache")
+# Treat entries as stale after this long, in case the file was deleted upstream
+UPLOAD_CACHE_TTL = 30 * 24 * 3600
+
 # Upload image using OpenAI Files API
 def upload_image(file_path):
     with open(file_path, "rb") as f:
-        result = client.files.create(file=f, purpose="user_data")
+        key = hashlib.file_digest(f, "blake2b").hexdigest()
+        with shelve.open(UPLOAD_CACHE) as cache:
+            hit = cache.get(key)
+            if hit and time.time() - hit[1] < UPLOAD_CACHE_TTL:
+                return hit[0]
+            f.seek(0)
+            result = client.files.create(file=f, purpose="user_data")
+            cache[key] = (result.id, time.time())
         return result.id
 
+MANUFACTURERS = [
+    "Enphase Energy Inc.",
+    "ABB",
+    "SMA America",
+    "SolarEdge Technologies",
+    "Fronius USA",
+    "OutBack Power",
+    "Huawei",
+    "Delta Electronics",
+    "Chilicon Power",
+    "other"
+]
+
+ApiBase.MODEL_ROLE = "You are an expert on analyzing Single Line Diagrams (SLD) of residential solar installations."
+
 def Equipment_Inverter(file_id, **kwargs):
     G = nx.DiGraph(**kwargs)
     #G.graph["api"] = ApiBase(model="gpt-4o")
@@ -33,21 +65,8 @@ def Equipment_Inverter(file_id, **kwargs):
         "\nIf there is no list, provide your own answer, but always the short answer first and then the explanation on a separate paragraph"
     )
 
-    ApiBase.MODEL_ROLE = "You are an expert on analyzing Single Line Diagrams (SLD) of residential solar installations."
-
     # Lists
-    manufacturer_list_json = [
-        "Enphase Energy Inc.",
-        "ABB",
-        "SMA America",
-        "SolarEdge Technologies",
-        "Fronius USA",
-        "OutBack Power",
-        "Huawei",
-        "Delta Electronics",
-        "Chilicon Power",
-        "other"
-    ]
+    manufacturer_list_json = MANUFACTURERS
 
     G.add_node("intro_inverter_type",
         prompt=(
@@ -100,28 +119,48 @@ def Equipment_Inverter(file_id, **kwargs):
 
     return G
 
+# All answers of the Equipment_Inverter tree in one structured-output call.
+# The tree is a straight chain after the architecture question, so running it
+# node by node costs one round-trip (with the image) per question; the
+# micro-only fields are null when the architecture is not microinverters.
+class MicroinverterSpec(BaseModel):
+    architecture: Literal["String Inverter without DC-DC Converters", "String Inverter with DC-DC Converters",
+                          "Microinverters", "AC Modules"]
+    manufacturer: Optional[str] = Field(default=None, description="Exactly as in the options list, or 'other'")
+    model: Optional[str] = Field(default=None, description="Full model number as listed on the diagram")
+    max_ocpd_amps: Optional[int] = None
+    interconnect: Optional[Literal["Main Service Panel", "Service Feeders", "Backup Loads Panel"]] = None
+    explanation: str = Field(description="Short justification citing language or components in the diagram")
+
+def extract_inverter(file_id):
+    prompt = (
+        "Analyze the attached Single Line Diagram. Use only clear evidence from the diagram and do not make assumptions.\n"
+        "1. What is the architecture type used for all inverters in this project?\n"
+        "If the architecture is Microinverters, also answer for Inverter 1:\n"
+        "2. Manufacturer, chosen from: " + ", ".join(MANUFACTURERS) + ".\n"
+        "3. Full model number.\n"
+        "4. Maximum overcurrent protection device (OCPD) rating allowed (Amps).\n"
+        "5. Where it is interconnected to the premises wiring and utility power.\n"
+        "Leave fields 2-5 null for other architectures."
+    )
+    response = client.responses.parse(
+        model="gpt-4.1-mini",
+        instructions=ApiBase.MODEL_ROLE,
+        input=[{"role": "user", "content": [{"type": "input_image", "file_id": file_id},
+                                            {"type": "input_text", "text": prompt}]}],
+        text_format=MicroinverterSpec,
+    )
+    return response.output_parsed
+
 def main():
     #image_path = "SA20250410-5395-123-336.png"
     image_path = "test.jpg"
     file_id = upload_image(image_path)
 
-
-    G = Equipment_Inverter(file_id)
-    tree = DecisionTree(G)
-    
-    results = {}
-    result= tree.run("intro_inverter_type")
-    results["inverter_type"] = results
-
-    if result.strip().lower().startswith("microinverters"):
-        results["micro_mfr1"] = tree.run("micro_mfr1")
-        results["micro_model1"] = tree.run("micro_model1")
-        results["micro_ocpd1"] = tree.run("micro_ocpd1")
-        results["micro_interconnect1"] = tree.run("micro_interconnect1")
-
-        tree.run("final", context={"answers": results})
-
-    print(tree.all_messages_txt)
+    # Equipment_Inverter(file_id) still builds the step-by-step question graph
+    # (for elm.tree.DecisionTree) if per-question branching is ever needed again.
+    spec = extract_inverter(file_id)
+    print(spec.model_dump_json(indent=2))
 
 if __name__ == "__main__":
     main()
@@ -1,18 +1,36 @@
 import os
-import json
-from typing import Any, Dict
-import importlib.util
-from importlib.machinery import SourceFileLoader
+import orjson
+import logging
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, Field, ValidationError
 
+# Log level applied by the first lambda_handler call (the Lambda runtime
+# already attaches a handler to the root logger); importing this module
+# leaves logging configuration alone.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+_logging_configured = False
 
-# Dynamically load the script since its filename starts with a digit and isn't a valid module name
-def _load_run_extraction():
-    script_path = os.path.join(os.path.dirname(__file__), "10_extract_LangGraph_wip.py")
-    loader = SourceFileLoader("lg_extract", script_path)
-    spec = importlib.util.spec_from_loader(loader.name, loader)
-    module = importlib.util.module_from_spec(spec)
-    loader.exec_module(module)
-    return getattr(module, "run_extraction")
+
+def _configure_logging() -> None:
+    global _logging_configured
+    if not _logging_configured:
+        logging.getLogger().setLevel(LOG_LEVEL)
+        _logging_configured = True
+
+# Imported once per container: the extraction module (its OpenAI client and
+# compiled graph) is built during Lambda init and reused by warm invocations,
+# and a broken import fails init instead of every request. The old
+# 10_extract_LangGraph_wip.py target was not a valid module name and had to
+# be re-executed through SourceFileLoader on each call.
+from run_extraction_v0 import run_extraction
+
+
+class LambdaRequest(BaseModel):
+    # Validated at the edge so malformed requests get a 400 straight away
+    prompt_id: str = Field(min_length=1)
+    file_id: str = Field(min_length=1)
+    image_ids: Optional[List[str]] = Field(default=None, max_length=2)
+    dry_run: bool = False
 
 
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -23,46 +41,43 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
       - image_ids: optional list of up to 2 strings
       - dry_run: optional boolean
 
+    A payload that does not match LambdaRequest returns 400 with the
+    validation errors as the body.
+
     Returns a JSON-serializable dict with the results from run_extraction.
     """
+    _configure_logging()
     try:
         body = event.get("body")
         if isinstance(body, str):
-            payload = json.loads(body) if body else {}
+            payload = orjson.loads(body) if body else {}
         elif isinstance(body, dict):
             payload = body
         else:
             payload = event
 
-        prompt_id = payload.get("prompt_id")
-        file_id = payload.get("file_id")
-        image_ids = payload.get("image_ids", [])
-        dry_run = bool(payload.get("dry_run", False))
+        try:
+            req = LambdaRequest.model_validate(payload)
+        except ValidationError as e:
+            return {"statusCode": 400, "body": e.json(include_url=False)}
 
-        if not prompt_id or not file_id:
-            return {
-                "statusCode": 400,
-                "body": json.dumps({"error": "prompt_id and file_id are required"})
-            }
+        result = run_extraction(req.prompt_id, req.file_id, image_ids=req.image_ids, dry_run=req.dry_run)
 
-        # Load the extraction function from the script and invoke it
-        run_extraction = _load_run_extraction()
-        result = run_extraction(prompt_id, file_id, image_ids=image_ids, dry_run=dry_run)
+        # json_output is already a compact JSON string: splice it into the body
+        # as-is instead of parsing and re-serializing it.
+        if isinstance(result, dict) and isinstance(result.get("json_output"), str):
+            return {"statusCode": 200, "body": '{"status":"ok","result":' + result["json_output"] + "}"}
 
         # app.invoke returns objects that may not be JSON-serializable (e.g., Pydantic models).
-        # Convert known fields to JSON-safe values. If there's `json_output`, return it.
+        # Convert known fields to JSON-safe values.
         body = {
             "status": "ok",
             "result": {}
         }
 
         if isinstance(result, dict):
-            # Try to include the json_output if present
             if result.get("json_output"):
-                try:
-                    body["result"] = json.loads(result["json_output"]) if isinstance(result["json_output"], str) else result["json_output"]
-                except Exception:
-                    body["result"] = {"raw": result.get("json_output")}
+                body["result"] = result["json_output"]
             else:
                 # Copy simple keys
                 for k in ["error", "note"]:
@@ -72,7 +87,7 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             # If not a dict, return its string representation
             body["result"] = {"raw": str(result)}
 
-        return {"statusCode": 200, "body": json.dumps(body)}
+        return {"statusCode": 200, "body": orjson.dumps(body, default=str).decode()}
 
     except Exception as e:
-        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+        return {"statusCode": 500, "body": orjson.dumps({"error": str(e)}).decode()}
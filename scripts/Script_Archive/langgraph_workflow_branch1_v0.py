@@ -7,16 +7,19 @@ name and this docstring.
 
 # Pull API key. Necessary? Comment for now. 
 
-import os, getpass
+import os, sys, getpass
 def _set_env(var: str):
     if not os.environ.get(var):
         os.environ[var] = getpass.getpass(f"{var}: ")
 
-# Set the OpenAI API key
-_set_env("OPENAI_API_KEY")
+# Set the OpenAI API key. Only the interactive CLI may prompt for it; anything
+# else (a server or Lambda worker with no TTY, tests, dry runs) can import the
+# module without a key, and call_llm fails fast instead of blocking forever on
+# getpass.
+if __name__ == "__main__":
+    _set_env("OPENAI_API_KEY")
 
-from openai import OpenAI
-from typing import Optional, List
+from typing import Optional
 from pydantic import BaseModel, Field, ConfigDict
 from langgraph.graph import StateGraph, START, END
 from typing_extensions import TypedDict
@@ -30,14 +33,20 @@ class EquipmentEntry(BaseModel):
     evidence_note: Optional[str] = None
 
 class ExtractionResult(BaseModel):
-    inverter: Optional[List[EquipmentEntry]] = Field(default=None, alias="Inverter", max_length=1)
-    module: Optional[List[EquipmentEntry]] = Field(default=None, alias="Module", max_length=1)
-    racking_system: Optional[List[EquipmentEntry]] = Field(default=None, alias="Racking System", max_length=1)
+    # One entry per equipment type (no single-element list wrapper)
+    inverter: Optional[EquipmentEntry] = Field(default=None, alias="Inverter")
+    module: Optional[EquipmentEntry] = Field(default=None, alias="Module")
+    racking_system: Optional[EquipmentEntry] = Field(default=None, alias="Racking System")
 
     model_config = ConfigDict(populate_by_name=True)
 
-# Initialize OpenAI client
-client = OpenAI()
+# (display label, attribute) for each equipment field, in print order
+_FIELDS = (("Inverter", "inverter"), ("Module", "module"), ("Racking System", "racking_system"))
+
+# OpenAI client: the pooled, pre-warmed one shared with the scripts one
+# folder up, instead of a client of its own
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from _openai_client import get_client  # noqa: E402
 
 # Define the extraction function using OpenAI Responses API
 def call_llm(state):
@@ -45,9 +54,11 @@ def call_llm(state):
     Calls the OpenAI Responses API with the multimodal prompt for equipment extraction.
     Returns structured JSON parsed into Pydantic models.
     """
+    if not os.environ.get("OPENAI_API_KEY"):
+        raise RuntimeError("OPENAI_API_KEY not set")
     try:
         # Use the same prompt ID from your working extraction script
-        response = client.responses.parse(
+        response = get_client().responses.parse(
             prompt={
                 "id": "pmpt_68d3321897f481979180ca9152284cd00a7317fbe81972f1"
             },
@@ -78,8 +89,9 @@ def call_llm(state):
         # Get the parsed Pydantic object
         result: ExtractionResult = response.output_parsed
         
-        # Convert to JSON for storage in state
-        json_output = result.model_dump_json(indent=2, by_alias=True, exclude_none=False)
+        # Convert to compact JSON for storage in state (pretty-printed only
+        # when main() writes the file)
+        json_output = result.model_dump_json(by_alias=True, exclude_none=False)
         
         return {
             "messages": state.get("messages", []),
@@ -174,12 +186,10 @@ def main():
         result = response["extraction_result"]
         
         # Print summary
-        for equipment_type in ["Inverter", "Module", "Racking System"]:
-            field_name = equipment_type.lower().replace(" ", "_")
-            equipment_list = getattr(result, field_name, None)
+        for equipment_type, field_name in _FIELDS:
+            equipment = getattr(result, field_name)
             
-            if equipment_list and len(equipment_list) > 0:
-                equipment = equipment_list[0]
+            if equipment:
                 print(f"\n🔧 {equipment_type}:")
                 print(f"   Found: {equipment.found}")
                 if equipment.manufacturer:
@@ -192,7 +202,7 @@ def main():
         # Save to JSON file
         if "json_output" in response:
             with open("extracted_fields.json", "w", encoding="utf-8") as f:
-                f.write(response["json_output"])
+                f.write(result.model_dump_json(indent=2, by_alias=True, exclude_none=False))
             print("\n💾 Saved to extracted_fields.json")
     else:
         print("❓ Unexpected response format")
@@ -4,9 +4,11 @@ Renamed from `31_run_extraction_wip.py` to a module-name-friendly filename so it
 can be imported normally (`import run_extraction_branch1_v0`).
 """
 
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List, Dict, Any
-from pydantic import BaseModel, Field, ConfigDict
-from openai import OpenAI
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter
 from langgraph.graph import StateGraph, START, END
 from typing_extensions import TypedDict
 
@@ -17,15 +19,40 @@ class EquipmentEntry(BaseModel):
     model: Optional[str] = None
     evidence_note: Optional[str] = None
 
+    model_config = ConfigDict(frozen=True)
+
 class ExtractionResult(BaseModel):
     inverter: Optional[List[EquipmentEntry]] = Field(default=None, alias="Inverter", max_length=1)
     module: Optional[List[EquipmentEntry]] = Field(default=None, alias="Module", max_length=1)
     racking_system: Optional[List[EquipmentEntry]] = Field(default=None, alias="Racking System", max_length=1)
 
-    model_config = ConfigDict(populate_by_name=True)
+    model_config = ConfigDict(populate_by_name=True, frozen=True)
+
+_ADAPTER = TypeAdapter(ExtractionResult)
+
+class DocumentResult(BaseModel):
+    # Number of the "Document i of n" message this result belongs to
+    document: int
+    result: ExtractionResult
+
+class ExtractionBatch(BaseModel):
+    # One entry per input document, tagged with its document number, so a
+    # result cannot silently be matched to the wrong document
+    results: List[DocumentResult]
+
+# The pooled, pre-warmed OpenAI client shared with the scripts one folder up,
+# reused by every call in this process
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from _openai_client import get_client  # noqa: E402
 
-# Initialize minimal client and graph wiring
-client = OpenAI()
+def _warmup():
+    # Run the validator/serializer once and build the client while the module
+    # is imported (Lambda init / SnapStart) instead of on the first billed call.
+    _ADAPTER.dump_json(ExtractionResult.model_validate({"Inverter": [{"found": False}]}), by_alias=True)
+    if os.environ.get("OPENAI_API_KEY"):
+        get_client()  # also starts the background connection pre-warm
+
+_warmup()
 
 # LLM caller used by the LangGraph workflow
 def call_llm(state, prompt_id: str, file_id: str, image_ids: Optional[List[str]] = None):
@@ -34,46 +61,129 @@ def call_llm(state, prompt_id: str, file_id: str, image_ids: Optional[List[str]]
         for img in image_ids[:2]:
             content.append({"type": "input_image", "file_id": img})
 
-    response = client.responses.parse(
+    response = get_client().responses.parse(
         prompt={"id": prompt_id},
         input=[{"role": "user", "content": content}],
         text_format=ExtractionResult
     )
     result: ExtractionResult = response.output_parsed
-    json_output = result.model_dump_json(indent=2, by_alias=True, exclude_none=False)
+    json_output = _ADAPTER.dump_json(result, by_alias=True).decode()
     return {"messages": state.get("messages", []), "extraction_result": result, "json_output": json_output}
 
+# Batch caller: packs several documents into a single Responses request so the
+# prompt is sent (and billed) once and only one RPM slot is used.
+def call_llm_batch(state):
+    items = state["items"]
+    messages = [{"role": "user", "content": [{"type": "input_text", "text": (
+        f"The {len(items)} messages below are separate documents, numbered 1 to {len(items)}. "
+        f"Extract each document on its own and return exactly one entry per document in `results`, "
+        f"in document order, with `document` set to that document's number."
+    )}]}]
+    for i, item in enumerate(items, start=1):
+        content = [{"type": "input_text", "text": f"Document {i} of {len(items)}"},
+                   {"type": "input_file", "file_id": item["file_id"]}]
+        for img in (item.get("image_ids") or [])[:2]:
+            content.append({"type": "input_image", "file_id": img})
+        messages.append({"role": "user", "content": content})
+
+    response = get_client().responses.parse(
+        prompt={"id": state["prompt_id"]},
+        input=messages,
+        text_format=ExtractionBatch
+    )
+    batch: ExtractionBatch = response.output_parsed
+    by_document = {r.document: r.result for r in batch.results}
+    if len(batch.results) != len(items) or sorted(by_document) != list(range(1, len(items) + 1)):
+        return {"messages": state.get("messages", []), "results": None,
+                "error": f"Expected one result for each of documents 1-{len(items)}, "
+                         f"got {[r.document for r in batch.results]}"}
+    results = [
+        {"extraction_result": r, "json_output": _ADAPTER.dump_json(r, by_alias=True).decode()}
+        for r in (by_document[i] for i in range(1, len(items) + 1))
+    ]
+    return {"messages": state.get("messages", []), "results": results}
+
+def _call_llm_node(state):
+    item = state["items"][0]
+    return call_llm(state, state["prompt_id"], item["file_id"], item.get("image_ids"))
+
+def _route(state):
+    return "call_llm_batch" if len(state.get("items") or []) > 1 else "call_llm"
+
 # Define state and graph
 class State(TypedDict):
     messages: list
+    prompt_id: Optional[str]
+    items: Optional[list]
     extraction_result: Optional[ExtractionResult]
     json_output: Optional[str]
+    results: Optional[list]
     error: Optional[str]
 
 workflow = StateGraph(State)
-workflow.add_node("call_llm", call_llm)
-workflow.add_edge(START, "call_llm")
+workflow.add_node("call_llm", _call_llm_node)
+workflow.add_node("call_llm_batch", call_llm_batch)
+workflow.add_conditional_edges(START, _route, ["call_llm", "call_llm_batch"])
 workflow.add_edge("call_llm", END)
+workflow.add_edge("call_llm_batch", END)
 app = workflow.compile()
 
+# A single document needs no graph machinery (state merging, node dispatch),
+# so run_extraction calls call_llm directly unless USE_LANGGRAPH is set.
+USE_LANGGRAPH = bool(os.getenv("USE_LANGGRAPH"))
+
 # The single exported function
 def run_extraction(prompt_id: str, file_id: str, image_ids: Optional[List[str]] = None, dry_run: bool = False) -> Dict[str, Any]:
     if dry_run:
         return {"status": "dry-run", "prompt_id": prompt_id, "file_id": file_id, "image_ids": image_ids}
 
-    state = {"messages": []}
-    content = [{"type": "input_file", "file_id": file_id}]
-    if image_ids:
-        for img in (image_ids or [])[:2]:
-            content.append({"type": "input_image", "file_id": img})
-
-    response = app.invoke({
-        "messages": state.get("messages", []),
-        "prompt": {"id": prompt_id},
-        "input": [{"role": "user", "content": content}]
-    })
-
-    return response
+    if USE_LANGGRAPH:
+        return app.invoke({
+            "messages": [],
+            "prompt_id": prompt_id,
+            "items": [{"file_id": file_id, "image_ids": image_ids}],
+        })
+
+    return call_llm({"messages": []}, prompt_id, file_id, image_ids)
+
+
+def run_extraction_many(jobs: List[Dict[str, Any]], max_workers: int = 16) -> List[Dict[str, Any]]:
+    """Run independent extractions in parallel threads.
+
+    Each job holds run_extraction keyword arguments (prompt_id, file_id,
+    image_ids, dry_run). The SDK releases the GIL while waiting on HTTP, so
+    threads overlap the round-trips; results come back in job order. A job
+    that raises gets an error entry in its place instead of failing the
+    rest of the batch.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        futures = [ex.submit(run_extraction, **job) for job in jobs]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append({"messages": [], "extraction_result": None, "json_output": None, "error": repr(e)})
+        return results
+
+
+def run_extraction_batch(prompt_id: str, items: List[Dict[str, Any]], dry_run: bool = False) -> Dict[str, Any]:
+    """Extract several documents in one API call.
+
+    Each item is a dict with a "file_id" and optional "image_ids" (up to 2).
+    Returns {"results": [...]} with one extraction_result/json_output pair per
+    item, in input order. A single item is routed to run_extraction, and no
+    items return {"results": []} without calling the API.
+    """
+    if dry_run:
+        return {"status": "dry-run", "prompt_id": prompt_id, "items": items}
+    if not items:
+        return {"results": []}
+    if len(items) == 1:
+        item = items[0]
+        return {"results": [run_extraction(prompt_id, item["file_id"], image_ids=item.get("image_ids"))]}
+
+    return app.invoke({"messages": [], "prompt_id": prompt_id, "items": items})
 
 
 if __name__ == "__main__":
@@ -4,7 +4,9 @@
 from unittest import result
 from dotenv import load_dotenv
 from openai import OpenAI
-import time
+from concurrent.futures import ThreadPoolExecutor
+import mimetypes
+import os
 
 # Load API key from environment variable
 load_dotenv()
@@ -13,8 +15,34 @@ client = OpenAI()
 
 # Include here a function that converts PDF into JPG. (And call it). 
 
+# Files at or above this size go through the Uploads API in parts instead of
+# one Files API POST, which fails on very large scans and must restart from
+# zero on a dropped connection.
+CHUNKED_UPLOAD_THRESHOLD = 100 * 1024 * 1024
+UPLOAD_PART_SIZE = 64 * 1024 * 1024  # Uploads API maximum per part
+UPLOAD_PARALLELISM = 4
+
+def _upload_part(upload_id, file_path, offset):
+  with open(file_path, "rb") as f:
+    f.seek(offset)
+    return client.uploads.parts.create(upload_id=upload_id, data=f.read(UPLOAD_PART_SIZE)).id
+
 # Function to create a file with the Files API
 def create_file(file_path):
+  size = os.path.getsize(file_path)
+  if size >= CHUNKED_UPLOAD_THRESHOLD:
+    upload = client.uploads.create(
+        purpose="user_data",
+        filename=os.path.basename(file_path),
+        bytes=size,
+        mime_type=mimetypes.guess_type(file_path)[0] or "application/octet-stream",
+    )
+    with ThreadPoolExecutor(max_workers=UPLOAD_PARALLELISM) as ex:
+      # map keeps the part IDs in file order, as uploads.complete requires
+      part_ids = list(ex.map(lambda offset: _upload_part(upload.id, file_path, offset),
+                             range(0, size, UPLOAD_PART_SIZE)))
+    return client.uploads.complete(upload_id=upload.id, part_ids=part_ids).file.id
+
   with open(file_path, "rb") as file_content:
     result = client.files.create(
         file=file_content,
@@ -29,42 +57,52 @@ def main():
     print(f"Uploading image: {image_path}")
     file_id = create_file(image_path)
 
-    # First message with image
-    response_1 = client.responses.create(
-        model="gpt-4.1-mini", # Per order of cost (high to low): "gpt-4.1-nano", "o4-mini", "gpt-4.1-mini".
-            # "gpt-4.1-nano" hallucinates!! Lets stick with "gpt-4.1-mini" for now.
-        instructions="Provide a short answer that contains only one of the options of the architecture type.",
-        input=[{
-            "role": "user",
-            "content": [
-                {"type": "input_text", "text": "Analyze the attached Single Line Diagram of a residential solar PV installation."},
-                {
-                    "type": "input_image",
-                    "file_id": file_id,
-                    "detail": "high",  # High detail is recommended for better analysis, but higher cost. Skip this field for 'auto'.
-                },
-                {"type": "input_text", "text": "What is the architecture type used for all inverters in this project? Choose in between: 'Microinverters', 'AC Modules', 'String Inverter without DC-DC Converters', 'String Inverter with DC-DC Converters'."},
-            ],
-        }],
-    )
-
-    print("Response 1:\n\n",response_1.output_text, "\n\n")
-
-    time.sleep(1)
+    # Both questions only need the uploaded image, so they are sent together
+    # instead of chaining the second onto the first (previous_response_id) and
+    # waiting for it; the brand/model answer is dropped again when the
+    # architecture turns out not to be microinverters.
+    def ask_architecture():
+        return client.responses.create(
+            model="gpt-4.1-mini", # Per order of cost (high to low): "gpt-4.1-nano", "o4-mini", "gpt-4.1-mini".
+                # "gpt-4.1-nano" hallucinates!! Lets stick with "gpt-4.1-mini" for now.
+            instructions="Provide a short answer that contains only one of the options of the architecture type.",
+            input=[{
+                "role": "user",
+                "content": [
+                    {"type": "input_text", "text": "Analyze the attached Single Line Diagram of a residential solar PV installation."},
+                    {
+                        "type": "input_image",
+                        "file_id": file_id,
+                        "detail": "high",  # High detail is recommended for better analysis, but higher cost. Skip this field for 'auto'.
+                    },
+                    {"type": "input_text", "text": "What is the architecture type used for all inverters in this project? Choose in between: 'Microinverters', 'AC Modules', 'String Inverter without DC-DC Converters', 'String Inverter with DC-DC Converters'."},
+                ],
+            }],
+        )
 
-    if response_1.output_text.strip().startswith("Microinverters"):
-        response_2 = client.responses.create(
+    def ask_inverter_model():
+        return client.responses.create(
             model="gpt-4.1-mini", # Per order of cost (high to low): "gpt-4.1-nano", "o4-mini", "gpt-4.1-mini".
-            previous_response_id=response_1.id,
             instructions="Provide a super short answer, followed by a short concise explanation.",
             input=[{
                 "role": "user",
                 "content": [
-                    {"type": "input_text", "text": "Can you see the attached image? What is the complete inverter brand and inverter model NO.?"},
+                    {"type": "input_text", "text": "Analyze the attached Single Line Diagram of a residential solar PV installation."},
+                    {"type": "input_image", "file_id": file_id, "detail": "high"},
+                    {"type": "input_text", "text": "What is the complete inverter brand and inverter model NO.?"},
                 ],
             }],
         )
-        print("Response 2:\n\n",response_2.output_text, "\n\n")
+
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        future_1 = ex.submit(ask_architecture)
+        future_2 = ex.submit(ask_inverter_model)
+        response_1 = future_1.result()
+        print("Response 1:\n\n",response_1.output_text, "\n\n")
+
+        if response_1.output_text.strip().startswith("Microinverters"):
+            response_2 = future_2.result()
+            print("Response 2:\n\n",response_2.output_text, "\n\n")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -8,11 +8,13 @@ from openai import OpenAI
 # Define client
 client = OpenAI()
 
-# Upload file
-file = client.files.create(
-    file=open("diagram.pdf", "rb"),
-    purpose="user_data"
-) 
+# Upload file. The open handle is streamed in chunks by httpx and closed
+# once the upload finishes.
+with open("diagram.pdf", "rb") as fh:
+    file = client.files.create(
+        file=("diagram.pdf", fh, "application/pdf"),
+        purpose="user_data"
+    )
 
 # Ask the model to analyze it via Responses API
 response = client.responses.create(
@@ -1,15 +1,43 @@
 # Import necessary libraries
 import base64
+import os
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 
 # Define client
 client = OpenAI()
 
-# Upload file using File API. https://platform.openai.com/docs/api-reference/files
-file = client.files.create(
-    file=open("diagram.pdf", "rb"),
-    purpose="user_data"
-) # Returns the uploaded file object:https://platform.openai.com/docs/api-reference/files/object
+# Files at or above this size go through the Uploads API in parts instead of
+# one Files API POST, which fails on very large scans and must restart from
+# zero on a dropped connection.
+CHUNKED_UPLOAD_THRESHOLD = 100 * 1024 * 1024
+UPLOAD_PART_SIZE = 64 * 1024 * 1024  # Uploads API maximum per part
+UPLOAD_PARALLELISM = 4
+
+def _upload_part(upload_id, file_path, offset):
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        return client.uploads.parts.create(upload_id=upload_id, data=f.read(UPLOAD_PART_SIZE)).id
+
+def create_file(file_path, mime_type="application/pdf"):
+    """Upload a file and return its file ID, in parts when it is large."""
+    size = os.path.getsize(file_path)
+    if size < CHUNKED_UPLOAD_THRESHOLD:
+        # Upload file using File API. https://platform.openai.com/docs/api-reference/files
+        # The open handle is streamed by httpx in chunks, never read whole
+        with open(file_path, "rb") as fh:
+            return client.files.create(file=(os.path.basename(file_path), fh, mime_type),
+                                       purpose="user_data").id
+    # Uploads API: https://platform.openai.com/docs/api-reference/uploads
+    upload = client.uploads.create(purpose="user_data", filename=os.path.basename(file_path),
+                                   bytes=size, mime_type=mime_type)
+    with ThreadPoolExecutor(max_workers=UPLOAD_PARALLELISM) as ex:
+        # map keeps the part IDs in file order, as uploads.complete requires
+        part_ids = list(ex.map(lambda offset: _upload_part(upload.id, file_path, offset),
+                               range(0, size, UPLOAD_PART_SIZE)))
+    return client.uploads.complete(upload_id=upload.id, part_ids=part_ids).file.id
+
+file_id = create_file("diagram.pdf") # The uploaded file object: https://platform.openai.com/docs/api-reference/files/object
 
 # File object example: 
 # FileObject(
@@ -32,7 +60,7 @@ response = client.responses.create(
             "content": [
                 {
                     "type": "input_file",
-                    "file_id": file.id,
+                    "file_id": file_id,
                 },
                 {
                     "type": "input_text",
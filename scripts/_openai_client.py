@@ -0,0 +1,179 @@
+"""Shared OpenAI clients for the scripts in this folder.
+
+Every script that talks to the API should go through this module instead of
+building its own `OpenAI()`, so one pooled HTTP session (and its TLS
+handshake) is reused for the life of the process / warm Lambda container:
+
+    from _openai_client import get_client
+    client = get_client()
+
+or, for scripts that used a module-level `client = OpenAI()`:
+
+    from _openai_client import CLIENT as client
+
+`CLIENT` is resolved lazily on first access, so importing this module does not
+require OPENAI_API_KEY until a client is actually needed. httpx and openai are
+likewise only imported when the first client is built, which keeps them out of
+dry runs and Lambda cold starts that never reach the API.
+
+An async client is tied to the event loop it first ran on, so
+`get_async_client()` keeps one per loop. Synchronous code that needs to await
+something (e.g. a warm Lambda handler running a batch of jobs) should use
+`run_async(coro)`, which runs it on one process-wide background loop, instead
+of `asyncio.run()`: the loop, and with it the async client's pooled
+connections, then survives from one call to the next.
+"""
+
+import os
+import asyncio
+import functools
+import threading
+import warnings
+import weakref
+from typing import TYPE_CHECKING, Any, Awaitable
+
+if TYPE_CHECKING:
+    from openai import OpenAI, AsyncOpenAI
+
+# Keep-alive pool shared by every API call made through the client. The read
+# timeout matches the SDK default (10 min) so long reasoning runs still finish.
+MAX_KEEPALIVE_CONNECTIONS = 32
+MAX_CONNECTIONS = 64
+READ_TIMEOUT = 600.0
+CONNECT_TIMEOUT = 5.0
+
+_client = None
+# PID that created `_client`. A forked worker must not reuse the parent's
+# connection pool (shared sockets/SSL state), so it builds its own client.
+_client_pid = None
+
+# AsyncOpenAI client per event loop (entries go away with their loop)
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+_async_clients_pid = None
+
+# Background loop used by run_async(), started on first use
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def _require_key():
+    if not os.environ.get("OPENAI_API_KEY"):
+        raise RuntimeError("OPENAI_API_KEY not set in environment. Activate your venv or set the env var before calling the API.")
+
+
+def _http_options():
+    import httpx
+    return dict(limits=httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                                    max_connections=MAX_CONNECTIONS),
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT))
+
+
+def _prewarm(c):
+    """Open the TCP+TLS session to the API host ahead of the first real call."""
+    try:
+        c._client.head(str(c.base_url), timeout=2)
+    except Exception:
+        # Best effort only; the real request will connect on its own.
+        pass
+
+
+def get_client() -> "OpenAI":
+    """Return the cached OpenAI client, creating it if necessary.
+
+    The client is built on a pooled httpx.Client and a background HEAD request
+    seeds the connection, so warm Lambda containers reuse the same session.
+    After os.fork() the child process gets a fresh client of its own.
+
+    Raises a RuntimeError if OPENAI_API_KEY is not set.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _require_key()
+        import httpx
+        from openai import OpenAI
+        _client = OpenAI(http_client=httpx.Client(**_http_options()))
+        _client_pid = os.getpid()
+        threading.Thread(target=_prewarm, args=(_client,), daemon=True).start()
+    return _client
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name="openai-async-loop", daemon=True).start()
+        return _loop
+
+
+def run_async(coro: Awaitable[Any]) -> Any:
+    """Run `coro` on the shared background event loop and return its result.
+
+    Use this instead of asyncio.run() from synchronous code, so repeated calls
+    (warm Lambda invocations, CLI helpers) keep reusing one loop and the async
+    client bound to it. Must not be called from that loop itself.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+
+def get_async_client() -> "AsyncOpenAI":
+    """Return the AsyncOpenAI client for the current event loop.
+
+    httpx.AsyncClient connections belong to the loop they were opened on, so
+    each loop gets a client of its own (reused for as long as that loop
+    lives). Called outside a running loop, it returns the client of the
+    run_async() background loop.
+    """
+    global _async_clients_pid
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = _background_loop()
+    if _async_clients_pid != os.getpid():
+        _async_clients.clear()
+        _async_clients_pid = os.getpid()
+    client = _async_clients.get(loop)
+    if client is None:
+        _require_key()
+        import httpx
+        from openai import AsyncOpenAI
+        client = _async_clients[loop] = AsyncOpenAI(http_client=httpx.AsyncClient(**_http_options()))
+    return client
+
+
+# SDK major version strict_text_format was written against
+TESTED_OPENAI_MAJOR = 1
+
+
+@functools.lru_cache(maxsize=None)
+def strict_text_format(model: type) -> dict:
+    """Return the Responses API `text` parameter for a strict `model` schema.
+
+    This is the format that responses.parse(text_format=model) sends, built
+    once per model. It uses the SDK's schema helper, which is private
+    (openai.lib._pydantic), so this is the only place that imports it. An SDK
+    upgrade that moves the helper fails here with a clear message, and an
+    untested major version gets a warning.
+    """
+    import openai
+    major = int(openai.__version__.split(".")[0])
+    if major != TESTED_OPENAI_MAJOR:
+        warnings.warn(f"strict_text_format was written for openai {TESTED_OPENAI_MAJOR}.x, "
+                      f"not {openai.__version__}", RuntimeWarning, stacklevel=2)
+    try:
+        from openai.lib._pydantic import to_strict_json_schema
+    except ImportError as e:
+        raise RuntimeError(f"openai {openai.__version__} no longer provides "
+                           "openai.lib._pydantic.to_strict_json_schema; update strict_text_format") from e
+    return {"format": {"type": "json_schema", "name": model.__name__,
+                       "schema": to_strict_json_schema(model), "strict": True}}
+
+
+def __getattr__(name):
+    # Lazy module attribute so `from _openai_client import CLIENT` works
+    # without building the client (or needing the key) at import time.
+    if name == "CLIENT":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
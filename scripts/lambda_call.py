@@ -15,6 +15,14 @@ Usage (Lambda):
         Manager before calling this wrapper.
     - Invoke Lambda with a JSON payload (API Gateway or direct invoke):
             {"script": "dev_scripts/run_extraction.py", "prompt_id": "pmpt_...", "file_id": "file-...", "image_ids": ["file-a","file-b"], "dry_run": false}
+    - To process several documents in one invocation pass a "jobs" list of
+        such dicts instead; the target must expose `run_extraction_many(jobs)`.
+    - The response body is {"status": "ok", "result": ...}, with a
+        successful extraction's JSON (`json_output`) as the result; jobs
+        return {"status": "ok", "results": [...]} holding one such envelope
+        per job. Failures before the target runs return {"error": ...}.
+    - Optionally set DEFAULT_SCRIPT so payloads may omit "script"; the script
+        is then imported once during Lambda init.
 
 Environment requirements:
 - The wrapper imports the target module, so ensure dependencies are installed in
@@ -30,19 +38,47 @@ Notes:
 """
 
 import os
-import json
+import logging
 import argparse
+import base64
 import importlib.util
+import inspect
+import orjson
 from importlib.machinery import SourceFileLoader
-from typing import Any, Dict
+from types import ModuleType
+from typing import Any, Dict, Tuple
 
+# Log level applied by the first lambda_handler call. The Lambda runtime
+# already attaches a handler to the root logger, so only its level is set,
+# and only when this module actually serves as the handler: importing the
+# module (e.g. from a CLI or tests) leaves logging configuration alone.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+_logging_configured = False
 
-def _load_run_extraction_from(path: str):
+
+def _configure_logging() -> None:
+    global _logging_configured
+    if not _logging_configured:
+        logging.getLogger().setLevel(LOG_LEVEL)
+        _logging_configured = True
+
+
+# Loaded target modules keyed by (absolute path, mtime). Warm Lambda
+# containers reuse the already-imported module (and its OpenAI client) instead
+# of re-executing it on every invocation; editing the file invalidates the key.
+_MODULE_CACHE: Dict[Tuple[str, float], ModuleType] = {}
+
+
+def _load_module_from(path: str) -> ModuleType:
     if not os.path.isabs(path):
         path = os.path.join(os.getcwd(), path)
     if not os.path.exists(path):
         raise FileNotFoundError(f"Target script not found: {path}")
 
+    key = (path, os.path.getmtime(path))
+    if key in _MODULE_CACHE:
+        return _MODULE_CACHE[key]
+
     # Determine a module name based on the file basename. Using the real
     # filename as the module name (rather than a constant like "target_module")
     # lets other introspection utilities (typing.get_type_hints, pydantic,
@@ -56,35 +92,81 @@ def _load_run_extraction_from(path: str):
     # get_type_hints can find it by module name during runtime introspection.
     import sys
     sys.modules[module_name] = module
+    # Let the target import helper modules that sit next to it (for example
+    # the shared `_openai_client`), wherever the wrapper is run from. The
+    # folder is appended, after site-packages, so a helper file next to a
+    # target can never shadow an installed package.
+    script_dir = os.path.dirname(path)
+    if script_dir not in sys.path:
+        sys.path.append(script_dir)
 
     # Execute the module in its namespace. Any import-time side effects will
     # run here; ensure the environment is prepared (OPENAI_API_KEY, venv, etc.).
     loader.exec_module(module)
+    _MODULE_CACHE[key] = module
+    return module
 
+
+def _load_run_extraction_from(path: str):
     # If the module defines a `run_extraction` callable, return it. Callers can
     # then invoke that function directly with (prompt_id, file_id, image_ids,
-    # dry_run...). If it's not present return None so the caller can fallback to
-    # running the script as a subprocess.
-    return getattr(module, "run_extraction", None)
+    # dry_run...). If it's not present return None so the caller can report a
+    # 400; the target is always run in-process, never via a subprocess, so the
+    # warmed imports and OpenAI client are reused.
+    return getattr(_load_module_from(path), "run_extraction", None)
+
+
+def _result_envelope(res: Any) -> str:
+    # Every run_extraction result is returned as {"status":"ok","result":...}.
+    # A successful extraction's json_output is already compact JSON, so it is
+    # spliced in as the result instead of being decoded and re-encoded;
+    # anything else (dry-run and error dicts) is encoded as it is.
+    if isinstance(res, dict) and isinstance(res.get("json_output"), str):
+        return '{"status":"ok","result":' + res["json_output"] + "}"
+    return orjson.dumps({"status": "ok", "result": res}, default=str).decode()
+
+
+def _jobs_body(results) -> str:
+    # One envelope per job, in the same shape as a single-run body
+    return '{"status":"ok","results":[' + ",".join(_result_envelope(r) for r in results) + "]}"
+
+
+# Script used when the payload does not name one. On Lambda, load it during the
+# init phase so the first invocation does not pay the import cost.
+DEFAULT_SCRIPT = os.environ.get("DEFAULT_SCRIPT")
+if DEFAULT_SCRIPT and os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+    _load_run_extraction_from(DEFAULT_SCRIPT)
+
+
+def _json_response(status_code: int, body: Any) -> Dict[str, Any]:
+    # `body` may already be a JSON string (the extraction's json_output), in
+    # which case it is passed through untouched instead of being re-encoded.
+    if not isinstance(body, str):
+        body = orjson.dumps(body, default=str).decode()
+    return {"statusCode": status_code, "headers": {"Content-Type": "application/json"}, "body": body}
 
 
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    _configure_logging()
     try:
         # Lambda events can come in different shapes. For API Gateway proxied
         # requests the JSON body is often in `event['body']` as a string. For
         # other invocations the event may *already* be a dict with the payload.
         payload = event.get("body")
-        if isinstance(payload, str):
+        if isinstance(payload, str) and event.get("isBase64Encoded"):
+            # Binary-mode API Gateway bodies: parse the decoded bytes directly.
+            payload = orjson.loads(base64.b64decode(payload)) if payload else {}
+        elif isinstance(payload, (str, bytes)):
             # When body is a JSON string, parse it. If it's empty use an empty
             # dict to avoid later attribute errors.
-            payload = json.loads(payload) if payload else {}
+            payload = orjson.loads(payload) if payload else {}
         elif payload is None:
             # If there's no `body` key assume the event itself contains the
             # payload (common when you invoke the lambda directly with a dict).
             payload = event
 
         # Extract expected fields from the payload
-        script = payload.get("script")
+        script = payload.get("script") or DEFAULT_SCRIPT
         prompt_id = payload.get("prompt_id")
         file_id = payload.get("file_id")
         image_ids = payload.get("image_ids", [])
@@ -92,22 +174,38 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
         # Validate required parameters early and return a 400-style response
         if not script:
-            return {"statusCode": 400, "body": json.dumps({"error": "script is required"})}
+            return _json_response(400, {"error": "script is required"})
+
+        # Multi-document request: {"jobs": [{"prompt_id": ..., "file_id": ...}, ...]}
+        jobs = payload.get("jobs")
+        if isinstance(jobs, list):
+            run_extraction_many = getattr(_load_module_from(script), "run_extraction_many", None)
+            if not run_extraction_many:
+                return _json_response(400, {"error": "target script does not expose run_extraction_many; cannot run jobs"})
+            results = run_extraction_many(jobs)
+            if inspect.isawaitable(results):
+                # Async implementations (asyncio.gather based) run on the
+                # shared background loop rather than a fresh asyncio.run()
+                # loop, so the async client cached on it stays usable across
+                # warm invocations
+                from _openai_client import run_async
+                results = run_async(results)
+            return _json_response(200, _jobs_body(results))
 
         # Import and call run_extraction directly (in-process). The target
         # script MUST expose `run_extraction(prompt_id, file_id, image_ids, dry_run)`.
         run_extraction = _load_run_extraction_from(script)
         if not run_extraction:
-            return {"statusCode": 400, "body": json.dumps({"error": "target script does not expose run_extraction; please export run_extraction(...)"})}
+            return _json_response(400, {"error": "target script does not expose run_extraction; please export run_extraction(...)"})
 
         res = run_extraction(prompt_id, file_id, image_ids=image_ids, dry_run=dry_run)
-        return {"statusCode": 200, "body": json.dumps({"status": "ok", "result": str(res)})}
+        return _json_response(200, _result_envelope(res))
 
     except Exception as e:
         # Any unexpected exception is returned as a 500 payload. In production
         # you might log the traceback to CloudWatch and return a more generic
         # message instead of exposing internal errors.
-        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+        return _json_response(500, {"error": str(e)})
 
 
 def main():
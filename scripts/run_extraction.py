@@ -6,17 +6,25 @@ This module exposes a programmatic function:
                                  file_id: Optional[str] = None,
                                  image_ids: Optional[List[str]] = None,
                                  dry_run: bool = False)
+and its async counterpart `arun_extraction(...)`, plus
+`run_extraction_many(jobs)` to run several extractions concurrently and
+`submit_batch(jobs)` / `poll_batch(batch_id)` for offline Batch API runs.
+`run_extraction_multi(items)` packs several documents into each API call.
+`upload_files(paths)` uploads local inputs concurrently and returns their IDs.
 
 Purpose:
 - Call the OpenAI Responses API (via LangGraph) to extract structured
     equipment information from provided file/image IDs.
-- On success the JSON result is saved next to this module as
-    `dev_scripts/extracted_fields.json` and also as a timestamped file
-    `dev_scripts/extracted_fields-<timestamp>.json`.
+- On success the JSON result is saved (in the background) to
+    `output files/extracted_fields-<timestamp>.json` and
+    `output files/extracted_fields.json` (latest), and appended as one line
+    to `output files/extracted_fields.jsonl`.
 
 How to run (CLI):
 - With explicit IDs (requires OPENAI_API_KEY in environment or active venv):
         python dev_scripts/run_extraction.py --prompt-id <PROMPT_ID> --file-id <FILE_ID> [image_id1 image_id2]
+- Uploading local inputs first (all uploads run concurrently):
+        python dev_scripts/run_extraction.py --pdf diagram.pdf --image page1.png --image page2.png
 - Using embedded defaults (no IDs):
         python dev_scripts/run_extraction.py --dry-run
 
@@ -33,15 +41,27 @@ Notes:
     dependencies installed. Consider storing outputs in S3 for persistence.
 """
 
-import os, getpass
-from datetime import datetime
-from typing import Optional, List, Dict, Any    
-from openai import OpenAI
-from typing import Optional, List
-from pydantic import BaseModel, Field, ConfigDict
-from langgraph.graph import StateGraph, START, END
-from typing_extensions import TypedDict
+import os
+import asyncio
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Any, Callable
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter, ValidationError
 import argparse
+# openai and langgraph are imported where they are first needed, so a
+# --dry-run (or a cached answer) does not pay for importing them.
 
 # Define the Pydantic models for structured output
 class EquipmentEntry(BaseModel):
@@ -50,29 +70,44 @@ class EquipmentEntry(BaseModel):
     model: Optional[str] = None
     evidence_note: Optional[str] = None
 
+    model_config = ConfigDict(frozen=True)
+
 class ExtractionResult(BaseModel):
     inverter: Optional[List[EquipmentEntry]] = Field(default=None, alias="Inverter", max_length=1)
     module: Optional[List[EquipmentEntry]] = Field(default=None, alias="Module", max_length=1)
     racking_system: Optional[List[EquipmentEntry]] = Field(default=None, alias="Racking System", max_length=1)
 
-    model_config = ConfigDict(populate_by_name=True)
+    model_config = ConfigDict(populate_by_name=True, frozen=True)
+
+# (display label, attribute) for each equipment field, in print order
+_FIELDS = (("Inverter", "inverter"), ("Module", "module"), ("Racking System", "racking_system"))
 
-# Initialize OpenAI client
-# Initialize OpenAI client lazily to avoid import-time requirement for OPENAI_API_KEY
-client = None
+# Built once; serializes straight to JSON bytes in pydantic-core
+_ADAPTER = TypeAdapter(ExtractionResult)
 
-def get_client():
-    """Return a cached OpenAI client, creating it if necessary.
+def dump_result(result: ExtractionResult, pretty: bool = False) -> str:
+    """Serialize an ExtractionResult with its alias keys ("Inverter", ...).
 
-    Raises a RuntimeError if OPENAI_API_KEY is not set.
+    The compact form is what callers receive as `json_output`; `pretty`
+    indents it for the human-readable files written to disk.
     """
-    global client
-    if client is None:
-        if not os.environ.get("OPENAI_API_KEY"):
-            raise RuntimeError("OPENAI_API_KEY not set in environment. Activate your venv or set the env var before calling the API.")
-        # create the OpenAI client
-        client = OpenAI()
-    return client
+    return _ADAPTER.dump_json(result, indent=2 if pretty else None, by_alias=True).decode()
+
+class ExtractionBatch(BaseModel):
+    # One ExtractionResult per input document, in the order they were sent
+    results: List[ExtractionResult]
+
+_BATCH_ADAPTER = TypeAdapter(ExtractionBatch)
+
+logger = logging.getLogger(__name__)
+
+# OpenAI clients are shared with the other scripts (pooled, created lazily on
+# first use so importing this module does not require OPENAI_API_KEY), as is
+# strict_text_format: the structured-output format sent with every request,
+# built once per model. Passing text_format=ExtractionResult instead makes
+# the SDK re-derive this strict schema from the Pydantic model on each call;
+# we send it pre-baked and validate the returned text ourselves.
+from _openai_client import get_client, get_async_client, run_async, strict_text_format
 
 # Embedded prompt and input IDs (from original 10_extract_LangGraph_wip.py)
 HARDCODE_PROMPT_ID = "pmpt_68d3321897f481979180ca9152284cd00a7317fbe81972f1"
@@ -82,36 +117,294 @@ HARDCODE_CONTENT = [
     {"type": "input_file", "file_id": "file-2rs6FKsigL6J9LQyf8hDB4"},
 ]
 
+# Append-only log of every extraction result (one compact JSON per line). The
+# descriptor is opened once and reused, so repeated CLI/Laravel runs in one
+# process cost a single write() each instead of an open/write/close cycle.
+_log_fds: Dict[str, int] = {}
+_log_lock = threading.Lock()
+
+def append_to_log(json_output: str, path: str) -> str:
+    """Append one JSON result line to the extraction log and return its path."""
+    with _log_lock:
+        fd = _log_fds.get(path)
+        if fd is None:
+            fd = _log_fds[path] = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.write(fd, json_output.encode("utf-8") + b"\n")
+    return path
+
+# Copies of each result in "../output files": a timestamped
+# extracted_fields-<ts>.json per result (pretty-printed), extracted_fields.json
+# for the latest one, and extracted_fields.jsonl with the history, one compact
+# line per result. One background writer thread keeps the writes ordered and
+# off the request path; pending writes still finish before the interpreter
+# exits.
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "..", "output files")
+OUTPUT_LOG = os.path.join(OUTPUT_DIR, "extracted_fields.jsonl")
+OUTPUT_LATEST = os.path.join(OUTPUT_DIR, "extracted_fields.json")
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="extraction-writer")
+
+def _utc_timestamp() -> str:
+    t = time.gmtime()
+    return "%04d-%02d-%02dT%02d-%02d-%02dZ" % (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec)
+
+def _create_timestamped_file(timestamp: str):
+    # O_EXCL: a second result within the same second gets -1, -2, ... rather
+    # than overwriting the first
+    for n in itertools.count():
+        suffix = f"-{n}" if n else ""
+        path = os.path.join(OUTPUT_DIR, f"extracted_fields-{timestamp}{suffix}.json")
+        try:
+            return path, os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            continue
+
+def _save_outputs(result: ExtractionResult, json_output: str) -> Optional[str]:
+    """Write the output files for one result; return the timestamped path."""
+    try:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        append_to_log(json_output, OUTPUT_LOG)
+
+        # pydantic-core emits UTF-8 bytes; write them as-is instead of
+        # decoding to str and re-encoding through a text-mode file
+        timestamped_path, fd = _create_timestamped_file(_utc_timestamp())
+        try:
+            os.write(fd, _ADAPTER.dump_json(result, indent=2, by_alias=True))
+        finally:
+            os.close(fd)
+
+        # Hard-link the same bytes under a temp name and rename it over the
+        # stable name, so readers never see a half-written
+        # extracted_fields.json (mkstemp keeps the temp name unique even with
+        # several processes writing to the folder)
+        tmp_fd, tmp_path = tempfile.mkstemp(prefix=".extracted_fields.", suffix=".tmp", dir=OUTPUT_DIR)
+        os.close(tmp_fd)
+        try:
+            os.remove(tmp_path)
+            try:
+                os.link(timestamped_path, tmp_path)
+            except OSError:
+                # Filesystem without hard links
+                shutil.copyfile(timestamped_path, tmp_path)
+            os.replace(tmp_path, OUTPUT_LATEST)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return timestamped_path
+    except Exception as e:
+        # If saving fails, log it; the caller already has the result
+        logger.warning("Failed to write extracted_fields files: %s", e)
+        return None
+
+# Exact-match cache of extraction results. Laravel retries and replays send the
+# same (prompt, file, images) request again; a hit skips the API call
+# entirely. /tmp survives between warm Lambda invocations (point
+# EXTRACTION_CACHE_DB at EFS to share it across containers). Off by default
+# (set EXTRACTION_CACHE=1, or pass use_cache=True / --cache), as in src/utils:
+# a prompt ID does not change when its dashboard version is edited.
+CACHE_ENABLED = os.environ.get("EXTRACTION_CACHE") == "1"
+CACHE_DB = os.environ.get("EXTRACTION_CACHE_DB", "/tmp/extractions.db")
+_cache = None
+_cache_lock = threading.Lock()
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = sqlite3.connect(CACHE_DB, check_same_thread=False)
+        # WAL lets readers (other warm containers on a shared EFS path, or
+        # other processes) keep hitting the cache while a result is written
+        _cache.execute("PRAGMA journal_mode=WAL")
+        _cache.execute("CREATE TABLE IF NOT EXISTS c(k TEXT PRIMARY KEY, v BLOB)")
+    return _cache
+
+def _cache_key(prompt_id: str, content: list, effort: Optional[str] = None, mode: str = "realtime") -> str:
+    # OpenAI file IDs are immutable, so the call mode ("realtime", "async",
+    # "graph" or "multi"), the prompt, the requested reasoning effort and the
+    # content items actually sent, in order (type, file ID, image detail),
+    # identify the request: a high-effort run must not be answered with a
+    # cached medium-effort result, nor a single-document call with a result
+    # from a packed multi-document one. BLAKE2b is faster than SHA-256 for
+    # short keys like this one.
+    items = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(f"{mode}|{prompt_id}|{effort}|{items}".encode(), digest_size=32).hexdigest()
+
+def _cache_get(key: str) -> Optional[str]:
+    with _cache_lock:
+        row = _get_cache().execute("SELECT v FROM c WHERE k = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def _cache_put(key: str, json_output: str) -> None:
+    with _cache_lock:
+        db = _get_cache()
+        db.execute("INSERT OR REPLACE INTO c(k, v) VALUES (?, ?)", (key, json_output))
+        db.commit()
+
+# Errors worth another attempt: rate limits and dropped/timed-out connections
+# (openai.APITimeoutError is an APIConnectionError), plus our own first-event
+# timeout below. Other API errors (bad prompt ID, invalid file) fail at once.
+@functools.lru_cache(maxsize=None)
+def _retryable_errors() -> tuple:
+    import openai
+    return (openai.RateLimitError, openai.APIConnectionError, TimeoutError)
+MAX_RETRIES = 3
+FIRST_TOKEN_TIMEOUT = float(os.environ.get("FIRST_TOKEN_TIMEOUT", "15"))
+
+def _stream_event_result(event, on_delta: Optional[Callable[[str], None]]):
+    """Handle one stream event; return the final Response once it arrives."""
+    if event.type == "response.output_text.delta":
+        if on_delta is not None:
+            on_delta(event.delta)
+    elif event.type == "response.completed":
+        return event.response
+    elif event.type in ("response.failed", "response.incomplete"):
+        response = event.response
+        raise RuntimeError(f"response {response.status}: {response.error or response.incomplete_details}")
+    elif event.type == "error":
+        raise RuntimeError(f"response stream error: {event.message}")
+    return None
+
+async def _astream_once(kwargs: dict, on_delta: Optional[Callable[[str], None]], first_token_timeout: float):
+    client = get_async_client()
+
+    async def _open():
+        # responses.create(stream=True) rather than responses.stream(): the
+        # latter insists on a `model`, while ours comes from the stored prompt
+        stream = await client.responses.create(stream=True, **kwargs)
+        try:
+            return stream, await stream.__anext__()
+        except StopAsyncIteration:
+            await stream.close()
+            raise RuntimeError("response stream ended before any event") from None
+        except BaseException:
+            await stream.close()
+            raise
+
+    try:
+        stream, event = await asyncio.wait_for(_open(), first_token_timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"no response event within {first_token_timeout:g}s") from None
+    try:
+        while True:
+            response = _stream_event_result(event, on_delta)
+            if response is not None:
+                return response
+            try:
+                event = await stream.__anext__()
+            except StopAsyncIteration:
+                raise RuntimeError("response stream ended before response.completed") from None
+    finally:
+        await stream.close()
+
+def _stream_once(kwargs: dict, on_delta: Optional[Callable[[str], None]], first_token_timeout: float):
+    """Stream one response, giving up if no event arrives within the timeout.
+
+    A stuck request otherwise sits on the 10 minute read timeout. The stream
+    runs on the shared background loop, where the wait for the response
+    headers and first event is cancelled once `first_token_timeout` passes;
+    later events (e.g. after a long reasoning pause) have no such limit.
+    `on_delta` is called from that loop's thread.
+    """
+    return run_async(_astream_once(kwargs, on_delta, first_token_timeout))
+
+def _parse_response(prompt_id: str, content: list, on_delta: Optional[Callable[[str], None]] = None,
+                    max_retries: int = MAX_RETRIES, first_token_timeout: float = FIRST_TOKEN_TIMEOUT,
+                    text: Optional[dict] = None, adapter: TypeAdapter = _ADAPTER,
+                    effort: Optional[str] = None):
+    """Get the parsed response for one user message.
+
+    The response is always streamed so a hung request is cut off after
+    `first_token_timeout` seconds; that, rate limits and connection errors are
+    retried up to `max_retries` times with exponential backoff (1s, 2s, 4s
+    plus jitter). When `on_delta` is given each output text delta is passed to
+    it as it arrives; the validated ExtractionResult is returned either way
+    (or whatever `adapter` validates, for another `text` format; the default
+    is the ExtractionResult schema). `effort`
+    overrides the prompt's reasoning effort.
+    """
+    kwargs = dict(
+        prompt={"id": prompt_id},
+        input=[{"role": "user", "content": content}],
+        # Enforce structured JSON output (schema built once by strict_text_format)
+        text=text or strict_text_format(ExtractionResult),
+    )
+    if effort:
+        kwargs["reasoning"] = {"effort": effort}
+    for attempt in range(max_retries + 1):
+        try:
+            return adapter.validate_json(_stream_once(kwargs, on_delta, first_token_timeout).output_text)
+        except _retryable_errors() as e:
+            if attempt == max_retries:
+                raise
+            delay = 2 ** attempt + random.random()
+            logger.warning("OpenAI request failed (%r); retrying in %.1fs", e, delay)
+            time.sleep(delay)
+
+# Optional cheap first pass for run_extraction (effort=...): most SLDs are
+# simple enough for medium reasoning on low-detail images; anything that looks
+# unsure is re-run at high effort / high detail.
+ESCALATE_EFFORT = "high"
+_UNSURE_MARKERS = ("illegible", "unreadable", "uncertain", "unclear", "ambiguous")
+
+def _with_image_detail(content: list, detail: str) -> list:
+    return [dict(part, detail=detail) if part["type"] == "input_image" else part for part in content]
+
+def _needs_escalation(result: ExtractionResult) -> bool:
+    """True when a low-effort result is not trustworthy enough to return.
+
+    A document where nothing was found is a legitimate answer, not a reason
+    to pay for a second call.
+    """
+    entries = [entry for _, attr in _FIELDS for entry in (getattr(result, attr) or ())]
+    for entry in entries:
+        if entry.found and not (entry.manufacturer and entry.model):
+            return True
+        note = (entry.evidence_note or "").lower()
+        if any(marker in note for marker in _UNSURE_MARKERS):
+            return True
+    return False
+
+def _adaptive_parse(prompt_id: str, content: list, on_delta: Optional[Callable[[str], None]], effort: Optional[str]):
+    if effort is None:
+        # Use the reasoning settings stored with the dashboard prompt
+        return _parse_response(prompt_id, content, on_delta)
+    if effort != ESCALATE_EFFORT:
+        # Not streamed: only the final pass reaches on_delta, so a consumer
+        # never sees two documents. A first pass that is kept is passed on
+        # whole once it is known to be final.
+        result = _parse_response(prompt_id, _with_image_detail(content, "low"), effort=effort)
+        if not _needs_escalation(result):
+            if on_delta is not None:
+                on_delta(dump_result(result))
+            return result
+        logger.info("Low-confidence result at effort=%s; retrying at %s", effort, ESCALATE_EFFORT)
+    return _parse_response(prompt_id, _with_image_detail(content, "high"), on_delta, effort=ESCALATE_EFFORT)
+
+def _graph_content(file_id: str, image_ids: Optional[List[str]]) -> list:
+    """Content list sent by call_llm (the LangGraph node)."""
+    content = [{"type": "input_file", "file_id": file_id}]
+    if image_ids:
+        for img in image_ids[:2]:
+            content.append({"type": "input_image", "file_id": img})
+    return content
+
 # Define the extraction function using OpenAI Responses API
-def call_llm(state, prompt_id: str, file_id: str, image_ids: Optional[List[str]] = None):
+def call_llm(state, prompt_id: str, file_id: str, image_ids: Optional[List[str]] = None,
+             on_delta: Optional[Callable[[str], None]] = None):
     """
     Calls the OpenAI Responses API with the multimodal prompt for equipment extraction.
     Returns structured JSON parsed into Pydantic models.
     """
     try:
         # Build the content list based on provided file and image ids
-        content = [{"type": "input_file", "file_id": file_id}]
-        if image_ids:
-            for img in image_ids[:2]:
-                content.append({"type": "input_image", "file_id": img})
+        content = _graph_content(file_id, image_ids)
 
-        response = get_client().responses.parse(
-            prompt={
-                "id": prompt_id
-            },
-            input=[{
-                "role": "user",
-                "content": content,
-            }],
-            # Enforce structured JSON output using Pydantic model
-            text_format=ExtractionResult
-        )
-        
         # Get the parsed Pydantic object
-        result: ExtractionResult = response.output_parsed
+        result: ExtractionResult = _parse_response(prompt_id, content, on_delta)
         
         # Convert to JSON for storage in state
-        json_output = result.model_dump_json(indent=2, by_alias=True, exclude_none=False)
+        json_output = dump_result(result)
         
         return {
             "messages": state.get("messages", []),
@@ -120,42 +413,116 @@ def call_llm(state, prompt_id: str, file_id: str, image_ids: Optional[List[str]]
         }
         
     except Exception as e:
-        import traceback
-        error_details = f"Extraction failed: {str(e)}\n{traceback.format_exc()}"
-        print(f"DEBUG Error: {error_details}")  # Add debug print
+        # Only pay for traceback formatting when someone is listening at DEBUG
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Extraction failed", exc_info=True)
         return {
             "messages": state.get("messages", []),
             "extraction_result": None,
             "json_output": None,
-            "error": error_details
+            "error": repr(e)
         }
 
 # Define state
-class State(TypedDict):
-    messages: list
-    extraction_result: Optional[ExtractionResult]
-    json_output: Optional[str]
-    error: Optional[str]
-
-# Create a new StateGraph
-workflow = StateGraph(State)
-# Add the nodes
-workflow.add_node("call_llm", call_llm)
-
-# Add the Edges
-workflow.add_edge(START, "call_llm")
-workflow.add_edge("call_llm", END)
-
-#Compile the workflow
-app = workflow.compile()
-
+# Slotted dataclass rather than a TypedDict: fixed attribute slots instead of a
+# per-state dict when LangGraph builds the state handed to each node
+@dataclass(slots=True)
+class State:
+    messages: list = field(default_factory=list)
+    file_id: Optional[str] = None
+    image_ids: Optional[List[str]] = None
+    extraction_result: Optional[ExtractionResult] = None
+    json_output: Optional[str] = None
+    error: Optional[str] = None
+
+@functools.lru_cache(maxsize=16)
+def make_app(prompt_id: str):
+    """Compile the extraction graph with `prompt_id` bound into its node.
+
+    One compiled graph is kept per prompt ID, so multi-tenant callers reuse
+    the wiring instead of rebuilding it; the node reads only the file and
+    image IDs from the state.
+    """
+    def _call_llm_node(state):
+        return call_llm({"messages": state.messages}, prompt_id, state.file_id, state.image_ids)
+
+    from langgraph.graph import StateGraph, START, END
+
+    # Create a new StateGraph
+    workflow = StateGraph(State)
+    # Add the nodes
+    workflow.add_node("call_llm", _call_llm_node)
+
+    # Add the Edges
+    workflow.add_edge(START, "call_llm")
+    workflow.add_edge("call_llm", END)
+
+    #Compile the workflow
+    return workflow.compile()
+
+def _get_app():
+    """Graph bound to the embedded prompt, compiled on first use."""
+    return make_app(HARDCODE_PROMPT_ID)
+
+def __getattr__(name):
+    # `module.app` is kept for existing `app.invoke` callers, but the graph is
+    # no longer compiled at import: the default run_extraction path never
+    # touches it, so Lambda cold starts skip the StateGraph build.
+    if name == "app":
+        return _get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# run_extraction calls the Responses API directly; the graph only adds state
+# merging and node dispatch around a single call. Set USE_LANGGRAPH to route
+# through make_app() instead (e.g. when more nodes are added).
+USE_LANGGRAPH = bool(os.getenv("USE_LANGGRAPH"))
+
+# On Lambda the module is imported during the (unbilled) init phase, so build
+# the client there and let the pre-warm overlap with container start-up.
+if os.environ.get("AWS_LAMBDA_FUNCTION_NAME") and os.environ.get("OPENAI_API_KEY"):
+    get_client()
+
+
+def _build_request(prompt_id: Optional[str], file_id: Optional[str], image_ids: Optional[List[str]]):
+    """Return the (prompt ID, content list) actually sent for a request."""
+    # Whatever the caller didn't pass falls back to the embedded defaults
+    prompt_id = prompt_id or HARDCODE_PROMPT_ID
+    if not file_id:
+        return prompt_id, HARDCODE_CONTENT
+    # Build content using provided IDs
+    content = [{"type": "input_file", "file_id": file_id}]
+    if image_ids:
+        for img in image_ids[:2]:
+            if img and img != "":
+                content.append({"type": "input_image", "file_id": img})
+    return prompt_id, content
 
 # Public run_extraction function so external callers (like wrappers) can
 # import and invoke the logic directly.
-def run_extraction(prompt_id: Optional[str] = None, file_id: Optional[str] = None, image_ids: Optional[List[str]] = None, dry_run: bool = False) -> Dict[str, Any]:
+def run_extraction(prompt_id: Optional[str] = None, file_id: Optional[str] = None, image_ids: Optional[List[str]] = None, dry_run: bool = False,
+                   on_delta: Optional[Callable[[str], None]] = None, use_cache: Optional[bool] = None,
+                   mode: str = "realtime", effort: Optional[str] = None) -> Dict[str, Any]:
     """
     Run the LangGraph extraction using provided prompt_id and file ids.
 
+    With mode="batch" the request is queued through the Batch API instead
+    (half price, results within 24h) and {"status": "submitted", "batch_id"}
+    is returned; collect the result later with poll_batch(batch_id).
+
+    Pass `on_delta` to stream the model output: it is called with each text
+    chunk as it is generated, before the parsed result is returned.
+
+    With use_cache=True (default: EXTRACTION_CACHE=1) identical requests
+    (same prompt, inputs, effort and call path) are answered from the local
+    result cache; the returned dict then also has "cached": True.
+
+    By default the reasoning settings stored with the dashboard prompt are
+    used. Pass `effort` (e.g. "medium") for a cheaper first pass at that
+    reasoning effort with low image detail, repeated at "high" effort / high
+    detail only when the result looks unsure (found equipment missing a
+    manufacturer or model, "illegible" notes); only the final pass is
+    streamed to `on_delta`. effort="high" skips straight to the second pass.
+
     Returns a dict with keys similar to the original script's `response`:
     - "extraction_result": parsed Pydantic object or None
     - "json_output": JSON string of the extraction
@@ -167,59 +534,275 @@ def run_extraction(prompt_id: Optional[str] = None, file_id: Optional[str] = Non
     if dry_run:
         return {"status": "dry-run", "prompt_id": used_prompt, "file_id": used_file_id, "image_ids": image_ids}
 
-    # For now use embedded prompt and content regardless of the function args.
-    # This will call the OpenAI Responses API directly and return the parsed
-    # pydantic result. Ensure OPENAI_API_KEY is set in the environment.
-    if dry_run:
-        return {"status": "dry-run", "prompt_id": prompt_id, "file_id": file_id, "image_ids": image_ids}
+    if mode == "batch":
+        batch_id = submit_batch([{"prompt_id": prompt_id, "file_id": file_id, "image_ids": image_ids}])
+        return {"status": "submitted", "batch_id": batch_id}
 
     try:
-        # If caller didn't pass prompt/file, use the embedded defaults
-        if not prompt_id or not file_id:
-            response = get_client().responses.parse(
-                prompt={"id": HARDCODE_PROMPT_ID},
-                input=[{"role": "user", "content": HARDCODE_CONTENT}],
-                text_format=ExtractionResult,
-            )
+        request_prompt, content = _build_request(prompt_id, file_id, image_ids)
+        use_cache = CACHE_ENABLED if use_cache is None else use_cache
+        cache_key = None
+        if use_cache:
+            if USE_LANGGRAPH:
+                # The graph's node builds its own content and keeps the
+                # prompt's reasoning settings
+                cache_key = _cache_key(used_prompt, _graph_content(used_file_id, image_ids), mode="graph")
+            else:
+                cache_key = _cache_key(request_prompt, content, effort)
+        if cache_key:
+            cached = _cache_get(cache_key)
+            if cached is not None:
+                return {"messages": [], "extraction_result": ExtractionResult.model_validate_json(cached),
+                        "json_output": cached, "cached": True}
+
+        if USE_LANGGRAPH:
+            state = make_app(used_prompt).invoke({"messages": [], "file_id": used_file_id, "image_ids": image_ids})
+            if state.get("error"):
+                return {"messages": [], "extraction_result": None, "json_output": None, "error": state["error"]}
+            result: ExtractionResult = state["extraction_result"]
         else:
-            # Build content using provided IDs
-            content = [{"type": "input_file", "file_id": used_file_id}]
-            if image_ids:
-                for img in image_ids[:2]:
-                    if img and img != "":
-                        content.append({"type": "input_image", "file_id": img})
-
-            response = get_client().responses.parse(
-                prompt={"id": used_prompt},
-                input=[{"role": "user", "content": content}],
-                text_format=ExtractionResult,
-            )
-
-        result: ExtractionResult = response.output_parsed
-        json_output = result.model_dump_json(indent=2, by_alias=True, exclude_none=False)
-        # Attempt to save JSON to timestamped file in output folder for easier retrieval
-        try:
-            ts = datetime.utcnow().strftime("%Y-%m-%dT%H-%M-%SZ")
-            base_dir = os.path.join(os.path.dirname(__file__), "..", "output files")
-            os.makedirs(base_dir, exist_ok=True)
-            timestamped_name = f"extracted_fields-{ts}.json"
-            out_path_ts = os.path.join(base_dir, timestamped_name)
-            with open(out_path_ts, "w", encoding="utf-8") as f:
-                f.write(json_output)
-
-            # Also update a stable/latest filename for quick access
-            out_path = os.path.join(base_dir, "extracted_fields.json")
-            with open(out_path, "w", encoding="utf-8") as f:
-                f.write(json_output)
-        except Exception as e:
-            # If saving fails, include a debug print but don't break the response
-            print(f"Warning: failed to write extracted_fields files: {e}")
+            result = _adaptive_parse(request_prompt, content, on_delta, effort)
+
+        json_output = dump_result(result)
+        if cache_key:
+            _cache_put(cache_key, json_output)
+        # Save a copy in the output folder for easier retrieval, in the
+        # background so the caller gets the result without waiting on disk
+        _writer.submit(_save_outputs, result, json_output)
         return {"messages": [], "extraction_result": result, "json_output": json_output}
     except Exception as e:
-        import traceback
-        error_details = f"Extraction failed: {str(e)}\n{traceback.format_exc()}"
-        print(f"DEBUG Error: {error_details}")
-        return {"messages": [], "extraction_result": None, "json_output": None, "error": error_details}
+        # The traceback is only formatted if a log handler actually emits it
+        logger.exception("Extraction failed")
+        return {"messages": [], "extraction_result": None, "json_output": None, "error": repr(e)}
+
+
+async def arun_extraction(prompt_id: Optional[str] = None, file_id: Optional[str] = None, image_ids: Optional[List[str]] = None,
+                          use_cache: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Async counterpart of run_extraction built on AsyncOpenAI.
+
+    Uses the same defaults and (opt-in) result cache, and returns the same
+    dict shape, but does not write the output files. Await several of these (or use
+    run_extraction_many) to overlap the network round-trips.
+    """
+    request_prompt, content = _build_request(prompt_id, file_id, image_ids)
+    # A single non-streamed call with the prompt's own settings: its own key
+    # space, apart from the sync path's
+    use_cache = CACHE_ENABLED if use_cache is None else use_cache
+    cache_key = _cache_key(request_prompt, content, mode="async") if use_cache else None
+    if cache_key:
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            return {"messages": [], "extraction_result": ExtractionResult.model_validate_json(cached),
+                    "json_output": cached, "cached": True}
+    try:
+        response = await get_async_client().responses.create(
+            prompt={"id": request_prompt},
+            input=[{"role": "user", "content": content}],
+            text=strict_text_format(ExtractionResult)
+        )
+        result: ExtractionResult = _ADAPTER.validate_json(response.output_text)
+        json_output = dump_result(result)
+    except Exception as e:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Extraction failed", exc_info=True)
+        return {"messages": [], "extraction_result": None, "json_output": None, "error": repr(e)}
+    if cache_key:
+        _cache_put(cache_key, json_output)
+    return {"messages": [], "extraction_result": result, "json_output": json_output}
+
+
+# Documents packed into one multi-document request. The long dashboard prompt
+# is billed once per call, so larger groups are cheaper, but every PDF and
+# image adds to the same context window; groups that still fail are split.
+MULTI_DOCS_PER_CALL = 5
+
+def _extract_group(prompt_id: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    import openai
+
+    if len(items) == 1:
+        content = _build_request(prompt_id, items[0]["file_id"], items[0].get("image_ids"))[1]
+        try:
+            result = _parse_response(prompt_id, content)
+        except Exception as e:
+            logger.exception("Extraction failed")
+            return [{"extraction_result": None, "json_output": None, "error": repr(e)}]
+        return [{"extraction_result": result, "json_output": dump_result(result)}]
+
+    content = []
+    for i, item in enumerate(items, start=1):
+        content.append({"type": "input_text", "text": f"=== DOC {i} of {len(items)} ==="})
+        content.extend(_build_request(prompt_id, item["file_id"], item.get("image_ids"))[1])
+    try:
+        batch: ExtractionBatch = _parse_response(prompt_id, content, text=strict_text_format(ExtractionBatch),
+                                                 adapter=_BATCH_ADAPTER)
+    except openai.BadRequestError:
+        # Typically the combined documents overflow the context window
+        batch = None
+    if batch is None or len(batch.results) != len(items):
+        # Fall back to halves rather than guessing which answer is which
+        mid = len(items) // 2
+        return _extract_group(prompt_id, items[:mid]) + _extract_group(prompt_id, items[mid:])
+    return [{"extraction_result": r, "json_output": dump_result(r)} for r in batch.results]
+
+
+def run_extraction_multi(items: List[Dict[str, Any]], prompt_id: Optional[str] = None,
+                         docs_per_call: int = MULTI_DOCS_PER_CALL, use_cache: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Extract several documents with as few API calls as possible.
+
+    Each item is a dict with a "file_id" and optional "image_ids" (up to 2).
+    Up to `docs_per_call` documents go into one request, separated by
+    "=== DOC i of n ===" markers, and the model returns one result per
+    document in order. A group that is rejected or answered with the wrong
+    number of results is split and retried. Returns {"results": [...]} with an
+    extraction_result/json_output (or error) dict per item, in input order.
+    With use_cache=True (default: EXTRACTION_CACHE=1) results are cached in
+    a key space of their own, apart from single-document calls.
+    """
+    used_prompt = prompt_id or HARDCODE_PROMPT_ID
+    use_cache = CACHE_ENABLED if use_cache is None else use_cache
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    keys: Dict[int, str] = {}
+    pending = []
+    for i, item in enumerate(items):
+        if use_cache:
+            keys[i] = _cache_key(*_build_request(used_prompt, item["file_id"], item.get("image_ids")), mode="multi")
+            cached = _cache_get(keys[i])
+            if cached is not None:
+                results[i] = {"extraction_result": _ADAPTER.validate_json(cached), "json_output": cached, "cached": True}
+                continue
+        pending.append(i)
+
+    for start in range(0, len(pending), docs_per_call):
+        group = pending[start:start + docs_per_call]
+        for i, res in zip(group, _extract_group(used_prompt, [items[i] for i in group])):
+            results[i] = res
+            if i in keys and res.get("json_output"):
+                _cache_put(keys[i], res["json_output"])
+    return {"results": results}
+
+
+class _RequestSpacer:
+    """Spread request starts evenly so a burst of jobs stays under an RPM cap."""
+
+    def __init__(self, rpm: int):
+        self.interval = 60.0 / rpm
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def run_extraction_many(jobs: List[Dict[str, Any]], max_concurrency: int = 8, rpm: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Run several extractions concurrently on one event loop.
+
+    Each job is a dict with "file_id" and optional "prompt_id"/"image_ids".
+    At most `max_concurrency` requests are in flight at once and, when `rpm`
+    is given, request starts are spaced to respect that rate limit. Results
+    are returned in the same order as `jobs`; results are not written to disk.
+    """
+    sem = asyncio.Semaphore(max_concurrency)
+    spacer = _RequestSpacer(rpm) if rpm else None
+
+    async def _one(job):
+        async with sem:
+            if spacer:
+                await spacer.wait()
+            return await arun_extraction(job.get("prompt_id") or HARDCODE_PROMPT_ID,
+                                         job["file_id"], job.get("image_ids"))
+
+    return await asyncio.gather(*(_one(job) for job in jobs))
+
+
+async def upload_files(paths: List[str], purpose: str = "user_data") -> List[str]:
+    """
+    Upload local files concurrently and return their file IDs, in order.
+
+    All uploads share the pooled async client and run at once, so uploading
+    a PDF plus its page images costs about the slowest single upload rather
+    than the sum of them.
+    """
+    client = get_async_client()
+
+    async def _one(path):
+        with open(path, "rb") as fh:
+            uploaded = await client.files.create(file=(os.path.basename(path), fh), purpose=purpose)
+        return uploaded.id
+
+    return list(await asyncio.gather(*(_one(p) for p in paths)))
+
+
+BATCH_TERMINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+def submit_batch(jobs: List[Dict[str, Any]]) -> str:
+    """
+    Queue extractions through the OpenAI Batch API and return the batch ID.
+
+    Jobs have the same shape as for run_extraction_many; each may also carry
+    a "custom_id" (defaults to its index), which poll_batch reports back.
+    Meant for offline work such as backfills and evaluation sweeps.
+    """
+    lines = []
+    for i, job in enumerate(jobs):
+        request_prompt, content = _build_request(job.get("prompt_id") or HARDCODE_PROMPT_ID,
+                                                 job.get("file_id"), job.get("image_ids"))
+        lines.append(json.dumps({
+            "custom_id": str(job.get("custom_id", i)),
+            "method": "POST",
+            "url": "/v1/responses",
+            "body": {
+                "prompt": {"id": request_prompt},
+                "input": [{"role": "user", "content": content}],
+                "text": strict_text_format(ExtractionResult),
+            },
+        }))
+    c = get_client()
+    batch_file = c.files.create(file=("extraction_batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+    batch = c.batches.create(input_file_id=batch_file.id, endpoint="/v1/responses", completion_window="24h")
+    return batch.id
+
+
+def poll_batch(batch_id: str, interval: float = 30.0):
+    """
+    Wait for a batch to finish and yield (custom_id, ExtractionResult) pairs.
+
+    Failed lines (those in the batch's error file, refusals and output that
+    does not validate) yield None in place of the result. Raises
+    RuntimeError if the batch itself failed, expired or was cancelled.
+    """
+    c = get_client()
+    batch = c.batches.retrieve(batch_id)
+    while batch.status not in BATCH_TERMINAL_STATES:
+        time.sleep(interval)
+        batch = c.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch_id} ended with status {batch.status}")
+    # Requests that failed are written to a separate error file
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in c.files.content(file_id).text.splitlines():
+            if not line:
+                continue
+            row = json.loads(line)
+            body = (row.get("response") or {}).get("body") or {}
+            text = next((part["text"] for item in body.get("output", []) if item.get("type") == "message"
+                         for part in item.get("content", []) if part.get("type") == "output_text"), None)
+            try:
+                result = _ADAPTER.validate_json(text) if text else None
+            except ValidationError as e:
+                logger.warning("Batch %s: invalid result for %s: %s", batch_id, row["custom_id"], e)
+                result = None
+            yield row["custom_id"], result
 
 
 # Keep CLI entrypoint for backward compatibility
@@ -228,41 +811,67 @@ def main():
     ap.add_argument("--prompt-id", dest="prompt_id", help="Prompt ID to use in the API call")
     ap.add_argument("--file-id", dest="file_id", help="File ID for the input file")
     ap.add_argument("image_ids", nargs="*", help="Optional file IDs for input images (up to 2)")
+    ap.add_argument("--pdf", help="Local PDF to upload and use instead of --file-id")
+    ap.add_argument("--image", dest="images", action="append", default=[],
+                    help="Local image to upload and use as an input image (repeatable, up to 2)")
     ap.add_argument("--dry-run", action="store_true", help="Do not call OpenAI API; return dry-run result")
+    ap.add_argument("--stream", action="store_true", help="Print the model output as it is generated")
+    ap.add_argument("--cache", dest="use_cache", action="store_true", default=None,
+                    help="Reuse cached results for identical requests (default: EXTRACTION_CACHE=1)")
+    ap.add_argument("--no-cache", dest="use_cache", action="store_false",
+                    help="Always call the API, ignoring cached results")
+    ap.add_argument("--effort", choices=["minimal", "low", "medium", "high"], default=None,
+                    help="Reasoning effort for a first pass, retried at high when unsure "
+                         "(default: the prompt's own settings)")
     args = ap.parse_args()
 
     prompt_id = args.prompt_id
     file_id = args.file_id
     image_ids = args.image_ids if args.image_ids else []
 
-    print ("Sending file IDs...")
-    result = run_extraction(prompt_id, file_id, image_ids=image_ids, dry_run=args.dry_run)
+    if (args.pdf or args.images) and not args.dry_run:
+        # Upload the local inputs in one concurrent batch
+        print("Uploading files...")
+        uploaded = asyncio.run(upload_files(([args.pdf] if args.pdf else []) + args.images))
+        if args.pdf:
+            file_id = uploaded.pop(0)
+        image_ids = image_ids + uploaded
 
+    print ("Sending file IDs...")
+    on_delta = (lambda delta: print(delta, end="", flush=True)) if args.stream else None
+    result = run_extraction(prompt_id, file_id, image_ids=image_ids, dry_run=args.dry_run, on_delta=on_delta,
+                            use_cache=args.use_cache, effort=args.effort)
+    if on_delta:
+        print()
+
+    # Collect the report and write it with a single stdout write
+    out = []
     if result.get("error"):
-        print(f"❌ Error: {result['error']}")
+        out.append(f"❌ Error: {result['error']}")
     elif "extraction_result" in result and result["extraction_result"]:
-        print("✅ Equipment extraction completed!")
-        print("\n📋 Extraction Results:")
+        out.append("✅ Equipment extraction completed!")
+        out.append("\n📋 Extraction Results:")
         res = result["extraction_result"]
-        for equipment_type in ["Inverter", "Module", "Racking System"]:
-            field_name = equipment_type.lower().replace(" ", "_")
-            equipment_list = getattr(res, field_name, None)
+        for equipment_type, field_name in _FIELDS:
+            equipment_list = getattr(res, field_name)
             if equipment_list and len(equipment_list) > 0:
                 equipment = equipment_list[0]
-                print(f"\n🔧 {equipment_type}:")
-                print(f"   Found: {equipment.found}")
+                out.append(f"\n🔧 {equipment_type}:")
+                out.append(f"   Found: {equipment.found}")
                 if equipment.manufacturer:
-                    print(f"   Manufacturer: {equipment.manufacturer}")
+                    out.append(f"   Manufacturer: {equipment.manufacturer}")
                 if equipment.model:
-                    print(f"   Model: {equipment.model}")
+                    out.append(f"   Model: {equipment.model}")
                 if equipment.evidence_note:
-                    print(f"   Note: {equipment.evidence_note}")
-        if "json_output" in result and result["json_output"]:
-            with open("extracted_fields.json", "w", encoding="utf-8") as f:
-                f.write(result["json_output"])
-            print("\n💾 Saved to extracted_fields.json")
+                    out.append(f"   Note: {equipment.evidence_note}")
+        # run_extraction() already saved the output files; just say where
+        if not result.get("cached"):
+            out.append(f"\n💾 Saved to {os.path.normpath(OUTPUT_LATEST)} (history in {os.path.basename(OUTPUT_LOG)})")
     else:
-        print("❓ Unexpected response format")
+        out.append("❓ Unexpected response format")
+    out.append("")
+    sys.stdout.write("\n".join(out))
+    sys.stdout.flush()
 
 
 if __name__ == "__main__":
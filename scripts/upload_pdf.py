@@ -3,16 +3,21 @@
 
 # Import necessary libraries
 import base64
-from openai import OpenAI
+import os
+import sys
+from _openai_client import CLIENT as client
 
-# Define client
-client = OpenAI()
+# PDF to upload: first CLI argument, or diagram.pdf in the current folder
+pdf_path = sys.argv[1] if len(sys.argv) > 1 else "diagram.pdf"
 
-# Upload file
-file = client.files.create(
-    file=open("diagram.pdf", "rb"),
-    purpose="user_data"
-) 
+# Upload file. Passing the open handle (not its bytes) lets httpx stream the
+# multipart body in chunks, so large PDFs are never fully buffered in memory;
+# the `with` block closes the descriptor once the upload finishes.
+with open(pdf_path, "rb") as fh:
+    file = client.files.create(
+        file=(os.path.basename(pdf_path), fh, "application/pdf"),
+        purpose="user_data"
+    )
 
 # Ask the model to analyze it via Responses API
 response = client.responses.create(
@@ -4,7 +4,8 @@ Development Scripts Utilities
 This module defines all functions used to define the scripts.
 
 Main functional areas:
-1. PDF Rendering: Convert PDF files to PNG images 
+1. PDF Rendering: Convert PDF files to PNG images (render_and_extract
+   pipelines rendering, upload and extraction page by page)
 2. OpenAI Extraction: Extract structured equipment data using OpenAI API
 3. Lambda/Module Loading: Dynamically load Python modules for Lambda execution
 4. File Management: Handle JSON output saving and timestamping
@@ -14,27 +15,70 @@ Dependencies:
 - pydantic: Data validation and serialization
 - langgraph: Graph-based workflow execution
 - pymupdf (fitz): PDF rendering
-- Standard library: os, json, datetime, argparse, importlib
+- pypdfium2 (optional): Faster PDF rendering, used instead of pymupdf when
+  installed together with Pillow (RENDER_BACKEND=pymupdf forces pymupdf)
+- orjson: Fast JSON encoding/decoding for results and Lambda payloads
+- Standard library: os, json, time, argparse, importlib
 
 Environment Requirements:
 - OPENAI_API_KEY: Required for extraction functions
+- EXTRACTION_S3_BUCKET (optional): Upload results to S3 instead of writing
+  local files (needs boto3; EXTRACTION_S3_PREFIX sets the key prefix,
+  default "extractions/")
+- EXTRACTION_DEBUG (optional): Include tracebacks in error messages
+- EXTRACTION_CACHE=1 (optional): Reuse cached results for repeated inputs
+  (stored in OPENAI_CACHE_DB, default /tmp/openai_cache.db)
+- PROMPT_CACHE_RETENTION (optional): "24h" for extended server-side prompt
+  caching, on models that support it (default: not sent)
 - Python 3.8+: For typing annotations and modern features
 """
 
+import atexit
 import os
 import json
-import argparse
-import importlib.util
+import shutil
+import asyncio
+import functools
+import hashlib
+import orjson
+import random
+import sqlite3
+import time
 import sys
-import fitz  # PyMuPDF
-from datetime import datetime
-from typing import Optional, List, Dict, Any, Set
-from importlib.machinery import SourceFileLoader
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, count
+from typing import Optional, List, Dict, Any, Callable, Set, Union, Iterable, Iterator, Tuple, TYPE_CHECKING
+
+# Imported where used instead: PyMuPDF (fitz) and multiprocessing only in the
+# rendering functions, argparse in the CLI parser builders and importlib's
+# loaders in load_module_from_path. A Lambda cold start that only runs an
+# extraction then never pays for them.
+if TYPE_CHECKING:
+    import argparse
+
+# Optional faster rendering backend
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+if os.environ.get("RENDER_BACKEND", "").lower() == "pymupdf":
+    pdfium = None
+if pdfium is not None:
+    # pypdfium2 saves pages through PIL images; without Pillow use PyMuPDF
+    from importlib.util import find_spec
+    if find_spec("PIL") is None:
+        pdfium = None
 
 # OpenAI and Pydantic imports (lazy loaded in extraction functions)
 try:
-    from openai import OpenAI
-    from pydantic import BaseModel, Field, ConfigDict
+    import httpx
+    import openai
+    from openai import OpenAI, AsyncOpenAI
+    from pydantic import BaseModel, Field, ConfigDict, ValidationError
     from langgraph.graph import StateGraph, START, END
     from typing_extensions import TypedDict
     EXTRACTION_DEPS_AVAILABLE = True
@@ -45,12 +89,13 @@ except ImportError:
 # PDF RENDERING UTILITIES
 # ============================================================================
 
-def parse_page_ranges(pages_arg: Optional[str], num_pages: int) -> List[int]:
+def parse_page_ranges(pages_arg: Union[str, int, Iterable[int], None], num_pages: int) -> List[int]:
     """
     Parse page range specification into a list of page numbers.
     
     Args:
-        pages_arg: String like "1,3-5,7" or None for all pages
+        pages_arg: String like "1,3-5,7", a single page number, an iterable
+            of page numbers (from programmatic callers), or None for all pages
         num_pages: Total number of pages in the document
     
     Returns:
@@ -60,11 +105,26 @@ def parse_page_ranges(pages_arg: Optional[str], num_pages: int) -> List[int]:
         parse_page_ranges("1,3-5", 10) -> [1, 3, 4, 5]
         parse_page_ranges(None, 5) -> [1, 2, 3, 4, 5]
         parse_page_ranges("2-4,1", 10) -> [1, 2, 3, 4]
+        parse_page_ranges(1, 10) -> [1]
     """
+    # Fast path for the common single-page request ("1" or 1)
+    if isinstance(pages_arg, int) or (isinstance(pages_arg, str) and pages_arg.isdigit()):
+        p = int(pages_arg)
+        if 1 <= p <= num_pages:
+            return [p]
+        raise ValueError(f"Invalid page number: {p}")
+    
     if not pages_arg:
         return list(range(1, num_pages + 1))
     
-    out = set()
+    # Page numbers passed directly need no string parsing, only validation
+    if not isinstance(pages_arg, str):
+        out = sorted(set(pages_arg))
+        if not out or out[0] < 1 or out[-1] > num_pages:
+            raise ValueError(f"Invalid page number in: {out}")
+        return out
+    
+    intervals = []
     for part in pages_arg.split(","):
         part = part.strip()
         if "-" in part:
@@ -72,44 +132,105 @@ def parse_page_ranges(pages_arg: Optional[str], num_pages: int) -> List[int]:
             a, b = int(a), int(b)
             if a < 1 or b < 1 or a > num_pages or b > num_pages or a > b:
                 raise ValueError(f"Invalid page range: {part}")
-            out.update(range(a, b + 1))
+            intervals.append((a, b))
         else:
             p = int(part)
             if p < 1 or p > num_pages:
                 raise ValueError(f"Invalid page number: {p}")
-            out.add(p)
+            intervals.append((p, p))
     
-    return sorted(out)
+    # Sort and coalesce overlapping/adjacent intervals, then expand once
+    intervals.sort()
+    merged = []
+    for s, e in intervals:
+        if merged and s <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+    
+    return list(chain.from_iterable(range(s, e + 1) for s, e in merged))
+
+
+# Document opened once per render worker process (see _init_render_worker).
+# Workers receive only the PDF path, since fitz.Document cannot be pickled.
+_worker_doc = None
+
+
+def _open_pdf(pdf_path: str):
+    """Open a PDF with the active backend (pypdfium2 if available, else PyMuPDF)."""
+    if pdfium:
+        return pdfium.PdfDocument(pdf_path)
+    import fitz  # PyMuPDF
+    return fitz.open(pdf_path)
+
+
+# Open documents kept between render_pdf_to_images calls, keyed by
+# (path, mtime) so an edited file is reopened. Rendering another page range
+# of the same PDF in a warm process then skips re-parsing it; the least
+# recently used document is closed once the cache is full.
+_DOC_CACHE_SIZE = 16
+_doc_cache: "OrderedDict[tuple, Any]" = OrderedDict()
+
+
+def _get_cached_pdf(pdf_path: str):
+    """Return an open document for `pdf_path`, reusing a cached one if current."""
+    key = (os.path.abspath(pdf_path), os.path.getmtime(pdf_path))
+    doc = _doc_cache.get(key)
+    if doc is not None:
+        _doc_cache.move_to_end(key)
+        return doc
+    doc = _doc_cache[key] = _open_pdf(pdf_path)
+    while len(_doc_cache) > _DOC_CACHE_SIZE:
+        _doc_cache.popitem(last=False)[1].close()
+    return doc
+
+
+@atexit.register
+def _close_cached_pdfs() -> None:
+    while _doc_cache:
+        _doc_cache.popitem()[1].close()
+
+
+def _init_render_worker(pdf_path: str) -> None:
+    """Pool initializer: open the PDF once for every page this worker renders."""
+    global _worker_doc
+    _worker_doc = _open_pdf(pdf_path)
 
 
-def render_pdf_to_images(pdf_path: str, dpi: int = 300, pages: Optional[str] = None, 
-                        grayscale: bool = False) -> List[str]:
+def _render_page_to_png(doc, page_num: int, zoom: float, grayscale: bool, output_path: str) -> str:
+    """Rasterize one 1-based page of an open document and save it as PNG."""
+    page = doc[page_num - 1]  # Convert to 0-based page index
+    if pdfium:
+        # PDFium renders grayscale directly (1 byte per pixel), no conversion
+        page.render(scale=zoom, grayscale=grayscale).to_pil().save(output_path)
+        return output_path
+
+    import fitz  # PyMuPDF
+
+    # Render directly in grayscale when requested (no RGB -> gray copy)
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+    pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False, colorspace=colorspace)
+    pixmap.save(output_path)
+    return output_path
+
+
+def _render_page_task(task: tuple) -> str:
+    return _render_page_to_png(_worker_doc, *task)
+
+
+def iter_render_pdf_to_images(pdf_path: str, dpi: int = 300, pages: Union[str, int, Iterable[int], None] = None,
+                              grayscale: bool = False, workers: Optional[int] = None) -> Iterator[Tuple[int, str]]:
     """
-    Render PDF pages to PNG images with customizable options.
-    
-    Args:
-        pdf_path: Path to the input PDF file
-        dpi: Resolution for rendering (default: 300)
-        pages: Page specification like "1,3-5" or None for all pages
-        grayscale: Whether to convert images to grayscale
+    Render PDF pages like render_pdf_to_images, yielding each page as it is done.
     
-    Returns:
-        List of paths to the generated PNG files
-        
-    Creates:
-        - A folder with the same name as the PDF (without extension)
-        - PNG files for each rendered page
-        - A copy of the original PDF in the output folder
-        
-    Example:
-        files = render_pdf_to_images("document.pdf", dpi=450, pages="1-3")
-        # Creates: document/document_p01.png, document/document_p02.png, etc.
+    Yields (page_num, png_path) pairs in page order, so a caller can start
+    uploading page 1 while later pages are still being rasterized.
     """
     if not os.path.isfile(pdf_path):
         raise FileNotFoundError(f"PDF file not found: {pdf_path}")
 
-    doc = fitz.open(pdf_path)
-    num_pages = doc.page_count
+    doc = _get_cached_pdf(pdf_path)
+    num_pages = len(doc)
     page_list = parse_page_ranges(pages, num_pages)
 
     # Create output folder named after the PDF
@@ -121,38 +242,96 @@ def render_pdf_to_images(pdf_path: str, dpi: int = 300, pages: Optional[str] = N
 
     # Calculate zoom factor from DPI
     zoom = dpi / 72.0
-    transform_matrix = fitz.Matrix(zoom, zoom)
 
     # Determine naming strategy
     single_page_output = (len(page_list) == 1)
-    saved_files = []
+    # Every output file shares this "<folder>/<pdf name>" prefix
+    out_prefix = os.path.join(output_folder, os.path.basename(base_name))
+    tasks = []
     
     for page_num in page_list:  # 1-based page numbers
-        page = doc[page_num - 1]  # Convert to 0-based for PyMuPDF
-        pixmap = page.get_pixmap(matrix=transform_matrix, alpha=False)
-
-        # Apply grayscale conversion if requested
-        if grayscale and pixmap.n > 1:
-            pixmap = fitz.Pixmap(fitz.csGRAY, pixmap)
-
         # Generate output filename
-        base_filename = os.path.basename(base_name)
         if single_page_output:
-            output_path = os.path.join(output_folder, f"{base_filename}.png")
+            output_path = f"{out_prefix}.png"
         else:
-            output_path = os.path.join(output_folder, f"{base_filename}_p{page_num:02d}.png")
-
-        pixmap.save(output_path)
-        saved_files.append(output_path)
+            output_path = f"{out_prefix}_p{page_num:02d}.png"
+        tasks.append((page_num, zoom, grayscale, output_path))
 
     # Copy original PDF to output folder
-    pdf_copy_path = os.path.join(output_folder, f"{os.path.basename(base_name)}.pdf")
+    pdf_copy_path = f"{out_prefix}.pdf"
     if not os.path.exists(pdf_copy_path):
-        with open(pdf_path, "rb") as src, open(pdf_copy_path, "wb") as dst:
-            dst.write(src.read())
-
-    doc.close()
-    return saved_files
+        # Hard-link when possible (no bytes copied); otherwise let shutil copy
+        # in-kernel instead of reading the whole PDF into memory
+        try:
+            os.link(pdf_path, pdf_copy_path)
+        except OSError:
+            shutil.copyfile(pdf_path, pdf_copy_path)
+
+    # Processes only when the caller asks for them
+    workers = min(workers or 1, len(tasks))
+    pool = None
+    if workers > 1:
+        import multiprocessing
+        try:
+            pool = multiprocessing.Pool(workers, initializer=_init_render_worker, initargs=(pdf_path,))
+        except OSError:
+            # No usable /dev/shm (e.g. AWS Lambda): render in this process
+            pool = None
+
+    if pool is None:
+        for task in tasks:
+            yield task[0], _render_page_to_png(doc, *task)
+    else:
+        with pool:
+            # At most `workers` pages are in flight: the next page is only
+            # sent to the pool once the caller has taken the oldest one, so
+            # rendering never runs further ahead of the consumer than that
+            in_flight = deque()
+            for task in tasks:
+                in_flight.append((task[0], pool.apply_async(_render_page_task, (task,))))
+                if len(in_flight) == workers:
+                    page_num, saved = in_flight.popleft()
+                    yield page_num, saved.get()
+            while in_flight:
+                page_num, saved = in_flight.popleft()
+                yield page_num, saved.get()
+
+    # `doc` stays open in the document cache for the next call
+
+
+def render_pdf_to_images(pdf_path: str, dpi: int = 300, pages: Union[str, int, Iterable[int], None] = None, 
+                        grayscale: bool = False, workers: Optional[int] = None) -> List[str]:
+    """
+    Render PDF pages to PNG images with customizable options.
+    
+    Pages are rendered in the calling process unless `workers` > 1 asks for
+    a process pool: rasterization is CPU-bound and neither MuPDF nor PDFium
+    renders in parallel threads of one process, so separate processes are
+    what scale with cores. Where a pool cannot be created (AWS Lambda has no
+    /dev/shm) rendering falls back to the calling process.
+    
+    Args:
+        pdf_path: Path to the input PDF file
+        dpi: Resolution for rendering (default: 300)
+        pages: Page specification like "1,3-5", a page number or list of
+            page numbers, or None for all pages
+        grayscale: Whether to convert images to grayscale
+        workers: Number of render processes (default: None, render in the
+            calling process)
+    
+    Returns:
+        List of paths to the generated PNG files
+        
+    Creates:
+        - A folder with the same name as the PDF (without extension)
+        - PNG files for each rendered page
+        - A copy of the original PDF in the output folder
+        
+    Example:
+        files = render_pdf_to_images("document.pdf", dpi=450, pages="1-3")
+        # Creates: document/document_p01.png, document/document_p02.png, etc.
+    """
+    return [path for _, path in iter_render_pdf_to_images(pdf_path, dpi, pages, grayscale, workers)]
 
 
 # ============================================================================
@@ -189,21 +368,91 @@ class ExtractionResult(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
 
 
-class ExtractionState(TypedDict):
+# ExtractionResult attribute -> JSON key, in output order
+_RESULT_FIELDS = {name: field.alias or name for name, field in ExtractionResult.model_fields.items()}
+
+
+class ExtractionState(TypedDict, total=False):
     """State dictionary for LangGraph workflow execution."""
     messages: list
+    prompt_id: str
+    file_id: str
+    image_ids: Optional[List[str]]
     extraction_result: Optional[ExtractionResult]
     json_output: Optional[str]
     error: Optional[str]
+    saved_paths: Dict[str, str]
+    summary: str
+
+
+def _entry_dict(entry: EquipmentEntry) -> Dict[str, Any]:
+    return {"found": entry.found, "manufacturer": entry.manufacturer,
+            "model": entry.model, "evidence_note": entry.evidence_note}
 
 
-# Global OpenAI client (lazy initialization)
+def _result_dict(result: ExtractionResult) -> Dict[str, Any]:
+    """Plain dict of an ExtractionResult keyed by its JSON aliases."""
+    if type(result) is not ExtractionResult:
+        return result.model_dump(by_alias=True)
+    data = {}
+    for attr, alias in _RESULT_FIELDS.items():
+        entries = getattr(result, attr)
+        data[alias] = [_entry_dict(e) for e in entries] if entries is not None else None
+    return data
+
+
+def _result_from_trusted(data: Dict[str, Any]) -> ExtractionResult:
+    """
+    Rebuild an ExtractionResult from a dict this module serialized itself.
+    
+    Skips Pydantic validation via model_construct; only use it for payloads
+    that were already validated before they were stored (e.g. cache rows).
+    """
+    fields = {}
+    for attr, alias in _RESULT_FIELDS.items():
+        entries = data.get(alias)
+        fields[attr] = [EquipmentEntry.model_construct(**e) for e in entries] if entries is not None else None
+    return ExtractionResult.model_construct(**fields)
+
+
+def dump_extraction_result(result: ExtractionResult) -> str:
+    """
+    Serialize an ExtractionResult to indented JSON with its alias keys.
+    
+    The schema is fixed, so the plain dict is assembled directly from the
+    attributes rather than through Pydantic's generic serializer; orjson then
+    does the encoding and indentation in C. None fields are kept as null so
+    every equipment key is always present. Subclasses (which may add fields)
+    go through model_dump instead.
+    """
+    return orjson.dumps(_result_dict(result), option=orjson.OPT_INDENT_2).decode()
+
+
+# Global OpenAI clients (lazy initialization). Async clients are kept per
+# event loop: an httpx.AsyncClient's connections belong to the loop that
+# opened them, and each asyncio.run() call starts a new one.
 _openai_client = None
+_async_openai_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+# Connection pool for the client: keep-alive connections are reused across
+# calls (and warm Lambda invocations) so only the first request pays for the
+# TLS handshake. The read timeout keeps the SDK's 10 minutes for long
+# reasoning runs; connecting, sending the request and waiting for a pooled
+# connection should each take seconds, so those fail fast instead.
+HTTP_MAX_CONNECTIONS = 32
+HTTP_KEEPALIVE_EXPIRY = 60.0
+HTTP_TIMEOUT = 600.0
+HTTP_CONNECT_TIMEOUT = 5.0
+HTTP_WRITE_TIMEOUT = 30.0
+HTTP_POOL_TIMEOUT = 5.0
 
 def get_openai_client() -> OpenAI:
     """
     Get or create the OpenAI client instance.
     
+    The client is built once on a pooled httpx.Client and reused, so
+    repeated calls share keep-alive connections.
+    
     Returns:
         Configured OpenAI client
         
@@ -219,13 +468,235 @@ def get_openai_client() -> OpenAI:
     if _openai_client is None:
         if not os.environ.get("OPENAI_API_KEY"):
             raise RuntimeError("OPENAI_API_KEY not set in environment. Set the environment variable before calling extraction functions.")
-        _openai_client = OpenAI()
+        _openai_client = OpenAI(http_client=httpx.Client(**_http_client_options()),
+                                timeout=_http_timeout(), max_retries=0)
     
     return _openai_client
 
 
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    Get or create the AsyncOpenAI client for the running event loop.
+    
+    Built on a pooled httpx.AsyncClient like get_openai_client(). Each event
+    loop gets its own client, reused while that loop lives, so repeated
+    asyncio.run() calls (e.g. warm Lambda invocations) never touch a client
+    bound to an earlier, closed loop. Must be called from a coroutine.
+    
+    Raises:
+        RuntimeError: If OPENAI_API_KEY is not set in environment, or if
+            there is no running event loop
+        ImportError: If OpenAI dependencies are not available
+    """
+    if not EXTRACTION_DEPS_AVAILABLE:
+        raise ImportError("OpenAI extraction dependencies not available. Install with: pip install openai pydantic langgraph")
+    
+    loop = asyncio.get_running_loop()
+    client = _async_openai_clients.get(loop)
+    if client is None:
+        if not os.environ.get("OPENAI_API_KEY"):
+            raise RuntimeError("OPENAI_API_KEY not set in environment. Set the environment variable before calling extraction functions.")
+        client = _async_openai_clients[loop] = AsyncOpenAI(http_client=httpx.AsyncClient(**_http_client_options()),
+                                                           timeout=_http_timeout(), max_retries=0)
+    
+    return client
+
+
+def _http_timeout() -> "httpx.Timeout":
+    return httpx.Timeout(connect=HTTP_CONNECT_TIMEOUT, read=HTTP_TIMEOUT,
+                         write=HTTP_WRITE_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+
+
+def _http_client_options() -> Dict[str, Any]:
+    """Pool limits and timeouts shared by the sync and async clients."""
+    return {
+        "limits": httpx.Limits(max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                               max_connections=HTTP_MAX_CONNECTIONS,
+                               keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+        "timeout": _http_timeout(),
+    }
+
+
+# Retry policy for transient API failures (rate limits, dropped connections,
+# 5xx). Other errors, such as a bad prompt or file ID, fail immediately. The
+# clients are built with max_retries=0, so this is the only retry layer and
+# the SDK's own retries do not stack on top of it.
+RETRY_MAX_TRIES = 8
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+
+def _retryable_errors() -> tuple:
+    # openai.APITimeoutError is a subclass of APIConnectionError
+    return (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """
+    Seconds to wait before retry `attempt` (0-based).
+    
+    Honors the server's Retry-After header when present; otherwise uses
+    exponential backoff with full jitter so concurrent callers spread out.
+    """
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY)
+        except ValueError:
+            pass  # HTTP-date form; fall back to backoff
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def _with_retry(call: Callable[[], Any]) -> Any:
+    """
+    Run an API call, retrying transient failures with backoff.
+    
+    `call` is invoked afresh on every attempt, so anything it consumes (e.g.
+    an open upload file) should be created inside it.
+    """
+    for attempt in range(RETRY_MAX_TRIES):
+        try:
+            return call()
+        except _retryable_errors() as e:
+            if attempt == RETRY_MAX_TRIES - 1:
+                raise
+            time.sleep(_retry_delay(e, attempt))
+
+
+def _parse_with_retry(**kwargs):
+    """Call responses.parse, retrying transient failures with backoff."""
+    return _with_retry(lambda: get_openai_client().responses.parse(**kwargs))
+
+
+async def _aparse_with_retry(**kwargs):
+    """Async counterpart of _parse_with_retry."""
+    for attempt in range(RETRY_MAX_TRIES):
+        try:
+            return await get_async_openai_client().responses.parse(**kwargs)
+        except _retryable_errors() as e:
+            if attempt == RETRY_MAX_TRIES - 1:
+                raise
+            await asyncio.sleep(_retry_delay(e, attempt))
+
+
+# Optional on-disk cache of extraction results keyed by the request inputs, so
+# re-driven Lambda events, test runs and debug loops skip the API call. Off by
+# default (set EXTRACTION_CACHE=1): the prompt behind a prompt ID can be edited
+# without its ID changing. /tmp survives between warm Lambda invocations.
+EXTRACTION_CACHE_ENABLED = os.environ.get("EXTRACTION_CACHE") == "1"
+EXTRACTION_CACHE_DB = os.environ.get("OPENAI_CACHE_DB", "/tmp/openai_cache.db")
+_cache_db = None
+_cache_lock = threading.Lock()
+
+
+def _get_cache_db() -> sqlite3.Connection:
+    global _cache_db
+    if _cache_db is None:
+        _cache_db = sqlite3.connect(EXTRACTION_CACHE_DB, check_same_thread=False)
+        _cache_db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, json TEXT)")
+    return _cache_db
+
+
+def _cache_key(prompt_id: str, content: List[Dict[str, Any]]) -> str:
+    """Hash of the prompt and input file IDs (image order does not matter)."""
+    inputs = sorted((item["type"], item["file_id"]) for item in content)
+    return hashlib.sha256(json.dumps({"p": prompt_id, "i": inputs}).encode("utf-8")).hexdigest()
+
+
+# Server-side prompt caching: requests sharing a prompt_cache_key are routed
+# together, so the long shared prompt prefix is more often served from
+# OpenAI's cache (lower time-to-first-token and cheaper input tokens).
+# Extended retention is opt-in, since models without it reject the request:
+# PROMPT_CACHE_RETENTION="24h" keeps cached prefixes across nightly batches,
+# and when unset nothing is sent (the default in-memory retention).
+PROMPT_CACHE_RETENTION = os.environ.get("PROMPT_CACHE_RETENTION", "")
+
+
+def _prompt_cache_options(prompt_id: str, prompt_cache_key: Optional[str] = None,
+                          prompt_cache_retention: Optional[str] = None, sdk: bool = True) -> Dict[str, Any]:
+    """
+    Keyword arguments enabling prompt caching (keyed by prompt ID by default).
+    
+    The pinned openai SDK predates the prompt_cache_retention parameter, so
+    for SDK calls it is sent through extra_body; pass sdk=False to get plain
+    request-body fields instead (Batch API lines).
+    """
+    options: Dict[str, Any] = {"prompt_cache_key": prompt_cache_key or prompt_id}
+    retention = prompt_cache_retention or PROMPT_CACHE_RETENTION
+    if retention:
+        if sdk:
+            options["extra_body"] = {"prompt_cache_retention": retention}
+        else:
+            options["prompt_cache_retention"] = retention
+    return options
+
+
+def _parse_extraction(prompt_id: str, content: List[Dict[str, Any]], prompt_cache_key: Optional[str] = None,
+                      prompt_cache_retention: Optional[str] = None,
+                      timeout: Optional[float] = None) -> ExtractionResult:
+    """
+    Run one structured extraction, answering from the result cache if enabled.
+    
+    `timeout` overrides the client's read timeout for this call only (e.g.
+    a tighter bound inside a Lambda's remaining time, or a looser one for a
+    very large document).
+    """
+    key = _cache_key(prompt_id, content) if EXTRACTION_CACHE_ENABLED else None
+    if key:
+        with _cache_lock:
+            row = _get_cache_db().execute("SELECT json FROM results WHERE key = ?", (key,)).fetchone()
+        if row:
+            return _result_from_trusted(orjson.loads(row[0]))
+
+    response = _parse_with_retry(
+        prompt={"id": prompt_id},
+        input=[{"role": "user", "content": content}],
+        text_format=ExtractionResult,
+        **_prompt_cache_options(prompt_id, prompt_cache_key, prompt_cache_retention),
+        **({"timeout": timeout} if timeout else {}),
+    )
+    result: ExtractionResult = response.output_parsed
+
+    if key:
+        with _cache_lock:
+            db = _get_cache_db()
+            db.execute("INSERT OR REPLACE INTO results (key, json) VALUES (?, ?)",
+                       (key, orjson.dumps(_result_dict(result)).decode()))
+            db.commit()
+    return result
+
+
+# Full tracebacks in error messages only when EXTRACTION_DEBUG is set:
+# formatting and printing them on every failed call (e.g. under sustained
+# rate limiting) is slow and floods CloudWatch.
+EXTRACTION_DEBUG = bool(os.environ.get("EXTRACTION_DEBUG"))
+
+
+def _error_details(prefix: str, e: Exception) -> str:
+    """Describe a caught exception; call from inside the except block."""
+    if EXTRACTION_DEBUG:
+        import traceback
+        return f"{prefix}: {str(e)}\n{traceback.format_exc()}"
+    return f"{prefix}: {type(e).__name__}: {e}"
+
+
+def _build_content(file_id: str, image_ids: Optional[List[str]] = None) -> List[Dict[str, str]]:
+    """
+    Build the multimodal input: the document plus up to 2 page images.
+    
+    Empty or whitespace-only image IDs are skipped.
+    """
+    content = [{"type": "input_file", "file_id": file_id}]
+    for img_id in (image_ids or ())[:2]:  # Limit to 2 images
+        if img_id and not img_id.isspace():
+            content.append({"type": "input_image", "file_id": img_id})
+    return content
+
+
 def call_openai_extraction(state: Dict[str, Any], prompt_id: str, file_id: str, 
-                          image_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+                          image_ids: Optional[List[str]] = None, prompt_cache_key: Optional[str] = None,
+                          prompt_cache_retention: Optional[str] = None) -> Dict[str, Any]:
     """
     Call OpenAI API for equipment extraction from documents.
     
@@ -237,31 +708,20 @@ def call_openai_extraction(state: Dict[str, Any], prompt_id: str, file_id: str,
         prompt_id: OpenAI prompt ID for the extraction task
         file_id: Primary document file ID
         image_ids: Optional list of image file IDs (max 2)
+        prompt_cache_key: Server-side prompt cache key (default: prompt_id)
+        prompt_cache_retention: "in-memory" or "24h" (default: PROMPT_CACHE_RETENTION,
+            unset sends none)
     
     Returns:
         Updated state dictionary with extraction results or error information
     """
     try:
         # Build content list for multimodal input
-        content = [{"type": "input_file", "file_id": file_id}]
-        if image_ids:
-            for img_id in image_ids[:2]:  # Limit to 2 images
-                if img_id and img_id.strip():
-                    content.append({"type": "input_image", "file_id": img_id})
+        content = _build_content(file_id, image_ids)
 
         # Call OpenAI Responses API with structured output
-        response = get_openai_client().responses.parse(
-            prompt={"id": prompt_id},
-            input=[{
-                "role": "user",
-                "content": content,
-            }],
-            text_format=ExtractionResult
-        )
-        
-        # Extract parsed result
-        result: ExtractionResult = response.output_parsed
-        json_output = result.model_dump_json(indent=2, by_alias=True, exclude_none=False)
+        result = _parse_extraction(prompt_id, content, prompt_cache_key, prompt_cache_retention)
+        json_output = dump_extraction_result(result)
         
         return {
             "messages": state.get("messages", []),
@@ -270,8 +730,7 @@ def call_openai_extraction(state: Dict[str, Any], prompt_id: str, file_id: str,
         }
         
     except Exception as e:
-        import traceback
-        error_details = f"OpenAI extraction failed: {str(e)}\n{traceback.format_exc()}"
+        error_details = _error_details("OpenAI extraction failed", e)
         print(f"DEBUG Error: {error_details}")
         return {
             "messages": state.get("messages", []),
@@ -281,6 +740,184 @@ def call_openai_extraction(state: Dict[str, Any], prompt_id: str, file_id: str,
         }
 
 
+async def call_openai_extraction_async(prompt_id: str, file_id: str,
+                                       image_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Async version of call_openai_extraction for running many documents at once.
+    
+    Args:
+        prompt_id: OpenAI prompt ID for the extraction task
+        file_id: Primary document file ID
+        image_ids: Optional list of image file IDs (max 2)
+    
+    Returns:
+        Dictionary with extraction_result/json_output, or error information
+    """
+    try:
+        content = _build_content(file_id, image_ids)
+
+        response = await _aparse_with_retry(
+            prompt={"id": prompt_id},
+            input=[{"role": "user", "content": content}],
+            text_format=ExtractionResult,
+            **_prompt_cache_options(prompt_id)
+        )
+
+        result: ExtractionResult = response.output_parsed
+        json_output = dump_extraction_result(result)
+        return {"messages": [], "extraction_result": result, "json_output": json_output}
+
+    except Exception as e:
+        return {"messages": [], "extraction_result": None, "json_output": None,
+                "error": f"OpenAI extraction failed: {str(e)}"}
+
+
+async def run_extraction_batch(payloads: List[Dict[str, Any]], concurrency: int = 8) -> List[Dict[str, Any]]:
+    """
+    Run many extractions concurrently over the shared async client.
+    
+    Each payload is a dict with "prompt_id", "file_id" and optional
+    "image_ids" (the same fields a Lambda event carries). At most
+    `concurrency` requests are in flight at once, so N documents take about
+    N / concurrency round-trips instead of N. Results are not saved to disk.
+    
+    Returns:
+        One call_openai_extraction_async result per payload, in input order
+        
+    Example:
+        results = asyncio.run(run_extraction_batch([
+            {"prompt_id": "pmpt_...", "file_id": "file-a"},
+            {"prompt_id": "pmpt_...", "file_id": "file-b", "image_ids": ["file-img"]},
+        ]))
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _bounded(payload: Dict[str, Any]) -> Dict[str, Any]:
+        async with sem:
+            return await call_openai_extraction_async(payload["prompt_id"], payload["file_id"],
+                                                      payload.get("image_ids"))
+
+    return await asyncio.gather(*(_bounded(p) for p in payloads))
+
+
+BATCH_TERMINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+def _shared_openai_client():
+    """The scripts' _openai_client module (home of strict_text_format)."""
+    # Reuse the copy the scripts already imported; otherwise load it by path,
+    # which leaves sys.path alone
+    return sys.modules.get("_openai_client") or load_module_from_path(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "_openai_client.py"))
+
+
+def run_extraction_batch_api(jobs: List[Dict[str, Any]]) -> str:
+    """
+    Submit extractions through the OpenAI Batch API and return the batch ID.
+    
+    Batch requests cost half as much and have far higher rate limits than
+    real-time calls, in exchange for results within 24 hours, which suits
+    offline multi-document runs.
+    
+    Args:
+        jobs: Dicts with "prompt_id", "file_id", optional "image_ids" and an
+            optional "custom_id" (defaults to the job's index)
+    
+    Returns:
+        Batch ID to pass to poll_batch()
+    """
+    # The same strict format responses.parse(text_format=ExtractionResult)
+    # sends, from the one wrapper around the SDK's private schema helper
+    text = _shared_openai_client().strict_text_format(ExtractionResult)
+    lines = []
+    for i, job in enumerate(jobs):
+        content = _build_content(job["file_id"], job.get("image_ids"))
+        lines.append(json.dumps({
+            "custom_id": str(job.get("custom_id", i)),
+            "method": "POST",
+            "url": "/v1/responses",
+            "body": {
+                "prompt": {"id": job["prompt_id"]},
+                "input": [{"role": "user", "content": content}],
+                "text": text,
+                **_prompt_cache_options(job["prompt_id"], sdk=False),
+            },
+        }))
+
+    client = get_openai_client()
+    payload = "\n".join(lines).encode("utf-8")
+    batch_file = _with_retry(lambda: client.files.create(file=("extraction_batch.jsonl", payload), purpose="batch"))
+    batch = _with_retry(lambda: client.batches.create(input_file_id=batch_file.id, endpoint="/v1/responses",
+                                                      completion_window="24h"))
+    return batch.id
+
+
+def poll_batch(batch_id: str, interval: float = 30.0) -> Dict[str, Optional[ExtractionResult]]:
+    """
+    Wait for a batch submitted by run_extraction_batch_api and parse its results.
+    
+    Returns:
+        Mapping of custom_id to ExtractionResult (None for lines in the
+        batch's error file and results that do not validate)
+        
+    Raises:
+        RuntimeError: If the batch failed, expired or was cancelled
+    """
+    client = get_openai_client()
+    batch = _with_retry(lambda: client.batches.retrieve(batch_id))
+    while batch.status not in BATCH_TERMINAL_STATES:
+        time.sleep(interval)
+        batch = _with_retry(lambda: client.batches.retrieve(batch_id))
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch_id} ended with status {batch.status}")
+
+    results: Dict[str, Optional[ExtractionResult]] = {}
+    # Requests that failed are written to a separate error file
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        output = _with_retry(lambda: client.files.content(file_id))
+        for line in output.text.splitlines():
+            if not line:
+                continue
+            row = json.loads(line)
+            body = (row.get("response") or {}).get("body") or {}
+            text = next((part["text"] for item in body.get("output", []) if item.get("type") == "message"
+                         for part in item.get("content", []) if part.get("type") == "output_text"), None)
+            try:
+                results[row["custom_id"]] = ExtractionResult.model_validate_json(text) if text else None
+            except ValidationError as e:
+                print(f"Warning: Invalid batch result for {row['custom_id']}: {e}")
+                results[row["custom_id"]] = None
+    return results
+
+
+# Default output location (next to this module), resolved once at import
+_MODULE_DIR = os.path.dirname(__file__)
+
+
+def _utc_timestamp() -> str:
+    """
+    Filename-safe UTC timestamp, e.g. "2023-11-20T15-30-45Z".
+    
+    Formatted from time.gmtime() directly: datetime.utcnow() is deprecated
+    and strftime is slower for this fixed layout.
+    """
+    t = time.gmtime()
+    return "%04d-%02d-%02dT%02d-%02d-%02dZ" % (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec)
+
+
+def _create_timestamped_file(base_directory: str, timestamp: str) -> Tuple[str, int]:
+    """Create a new extracted_fields-<timestamp>[-n].json; return its path and fd."""
+    for n in count():
+        suffix = f"-{n}" if n else ""
+        path = os.path.join(base_directory, f"extracted_fields-{timestamp}{suffix}.json")
+        try:
+            return path, os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            continue
+
+
 def save_extraction_results(json_output: str, base_directory: str) -> Dict[str, str]:
     """
     Save extraction results to both latest and timestamped files.
@@ -295,20 +932,44 @@ def save_extraction_results(json_output: str, base_directory: str) -> Dict[str,
     Example:
         paths = save_extraction_results(json_data, "/path/to/dev_scripts")
         # Creates: extracted_fields.json and extracted_fields-2023-11-20T15-30-45Z.json
+        # (or ...-45Z-1.json if that second's name is already taken)
     """
     try:
-        timestamp = datetime.utcnow().strftime("%Y-%m-%dT%H-%M-%SZ")
+        timestamp = _utc_timestamp()
         
-        # Save timestamped version
-        timestamped_filename = f"extracted_fields-{timestamp}.json"
-        timestamped_path = os.path.join(base_directory, timestamped_filename)
-        with open(timestamped_path, "w", encoding="utf-8") as f:
-            f.write(json_output)
-
-        # Save/update latest version
+        # Save timestamped version: encoded once, one unbuffered write. The
+        # name is claimed with O_EXCL, so results saved within the same
+        # second (e.g. concurrent run_extraction calls) get a -1, -2, ...
+        # suffix instead of overwriting each other.
+        timestamped_path, fd = _create_timestamped_file(base_directory, timestamp)
+        try:
+            os.write(fd, json_output.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+        # Point the latest version at the same bytes with a hard link
+        # instead of writing them a second time. The link is made under a
+        # temporary name unique to this call (reserved with mkstemp) and
+        # renamed over the old file, so concurrent saves never touch each
+        # other's temp file and readers always see a complete
+        # extracted_fields.json.
         latest_path = os.path.join(base_directory, "extracted_fields.json")
-        with open(latest_path, "w", encoding="utf-8") as f:
-            f.write(json_output)
+        tmp_fd, latest_tmp = tempfile.mkstemp(prefix=".extracted_fields.", suffix=".tmp", dir=base_directory)
+        os.close(tmp_fd)
+        try:
+            os.remove(latest_tmp)
+            try:
+                os.link(timestamped_path, latest_tmp)
+            except OSError:
+                # Filesystem without hard links
+                shutil.copyfile(timestamped_path, latest_tmp)
+            os.replace(latest_tmp, latest_path)
+        except BaseException:
+            try:
+                os.remove(latest_tmp)
+            except FileNotFoundError:
+                pass
+            raise
             
         return {
             "latest": latest_path,
@@ -320,8 +981,57 @@ def save_extraction_results(json_output: str, base_directory: str) -> Dict[str,
         return {}
 
 
+# Optional S3 destination for results. Lambda's /tmp is small and lost with
+# the container, so production can set EXTRACTION_S3_BUCKET (and optionally
+# EXTRACTION_S3_PREFIX). The upload completes before run_extraction returns:
+# a frozen Lambda may never be thawed again, so an upload left running in the
+# background could be lost. Failed uploads are saved under the temp directory
+# instead, the only writable location in a Lambda package.
+EXTRACTION_S3_BUCKET = os.environ.get("EXTRACTION_S3_BUCKET")
+EXTRACTION_S3_PREFIX = os.environ.get("EXTRACTION_S3_PREFIX", "extractions/")
+_s3_client = None
+
+
+def _save_extraction_to_s3(json_output: str, fallback_directory: str) -> None:
+    """
+    Upload one result to S3.
+    
+    Falls back to save_extraction_results in `fallback_directory` if boto3
+    is missing or the upload fails, so the result is not lost.
+    """
+    global _s3_client
+    try:
+        if _s3_client is None:
+            import boto3
+            _s3_client = boto3.client("s3")
+        _s3_client.put_object(
+            Bucket=EXTRACTION_S3_BUCKET,
+            Key=f"{EXTRACTION_S3_PREFIX}extracted_fields-{_utc_timestamp()}.json",
+            Body=json_output.encode("utf-8"),
+            ContentType="application/json",
+        )
+    except Exception as e:
+        print(f"Warning: S3 upload failed, saving locally instead: {e}")
+        save_extraction_results(json_output, fallback_directory)
+
+
+# Embedded defaults for testing/development, built once at import rather than
+# on every run_extraction call. A tuple, so the shared sequence itself cannot
+# be appended to; it is copied into a list where the API needs one.
+_DEFAULT_PROMPT_ID = "pmpt_68d3321897f481979180ca9152284cd00a7317fbe81972f1"
+_DEFAULT_CONTENT = (
+    {"type": "input_image", "file_id": "file-RYMeojcDFBtoDYNwne2XHe"},
+    {"type": "input_image", "file_id": "file-91iJcHy825krxoJeR1pRR6"},
+    {"type": "input_file", "file_id": "file-2rs6FKsigL6J9LQyf8hDB4"},
+)
+_DEFAULT_FILE_ID = _DEFAULT_CONTENT[-1]["file_id"]
+
+
 def run_extraction(prompt_id: Optional[str] = None, file_id: Optional[str] = None, 
-                  image_ids: Optional[List[str]] = None, dry_run: bool = False) -> Dict[str, Any]:
+                  image_ids: Optional[List[str]] = None, dry_run: bool = False,
+                  prompt_cache_key: Optional[str] = None,
+                  prompt_cache_retention: Optional[str] = None,
+                  timeout: Optional[float] = None) -> Dict[str, Any]:
     """
     Execute the complete equipment extraction workflow.
     
@@ -333,6 +1043,10 @@ def run_extraction(prompt_id: Optional[str] = None, file_id: Optional[str] = Non
         file_id: Document file ID (uses default if None)
         image_ids: Optional image file IDs
         dry_run: If True, return mock data without calling API
+        prompt_cache_key: Server-side prompt cache key (default: the prompt ID)
+        prompt_cache_retention: "in-memory" or "24h" (default: PROMPT_CACHE_RETENTION,
+            unset sends none)
+        timeout: Per-call API timeout in seconds (default: HTTP_TIMEOUT)
     
     Returns:
         Dictionary containing:
@@ -342,20 +1056,13 @@ def run_extraction(prompt_id: Optional[str] = None, file_id: Optional[str] = Non
         - messages: Empty list (for LangGraph compatibility)
         
     Side Effects:
-        - Saves results to extracted_fields.json and timestamped files
+        - Saves results to extracted_fields.json and timestamped files, or
+          uploads them to S3 if EXTRACTION_S3_BUCKET is set
         - Prints debug information on errors
     """
-    # Embedded defaults for testing/development
-    DEFAULT_PROMPT_ID = "pmpt_68d3321897f481979180ca9152284cd00a7317fbe81972f1"
-    DEFAULT_CONTENT = [
-        {"type": "input_image", "file_id": "file-RYMeojcDFBtoDYNwne2XHe"},
-        {"type": "input_image", "file_id": "file-91iJcHy825krxoJeR1pRR6"},
-        {"type": "input_file", "file_id": "file-2rs6FKsigL6J9LQyf8hDB4"},
-    ]
-    
     # Use provided IDs or fall back to defaults
-    used_prompt = prompt_id or DEFAULT_PROMPT_ID
-    used_file_id = file_id or (DEFAULT_CONTENT[-1].get("file_id") if DEFAULT_CONTENT else None)
+    used_prompt = prompt_id or _DEFAULT_PROMPT_ID
+    used_file_id = file_id or _DEFAULT_FILE_ID
     
     if dry_run:
         return {
@@ -369,32 +1076,23 @@ def run_extraction(prompt_id: Optional[str] = None, file_id: Optional[str] = Non
         # Choose between provided IDs and embedded defaults
         if not prompt_id or not file_id:
             # Use embedded defaults
-            response = get_openai_client().responses.parse(
-                prompt={"id": DEFAULT_PROMPT_ID},
-                input=[{"role": "user", "content": DEFAULT_CONTENT}],
-                text_format=ExtractionResult,
-            )
+            result = _parse_extraction(_DEFAULT_PROMPT_ID, list(_DEFAULT_CONTENT),
+                                       prompt_cache_key, prompt_cache_retention, timeout)
         else:
             # Use provided IDs
-            content = [{"type": "input_file", "file_id": used_file_id}]
-            if image_ids:
-                for img in image_ids[:2]:
-                    if img and img.strip():
-                        content.append({"type": "input_image", "file_id": img})
-
-            response = get_openai_client().responses.parse(
-                prompt={"id": used_prompt},
-                input=[{"role": "user", "content": content}],
-                text_format=ExtractionResult,
-            )
+            content = _build_content(used_file_id, image_ids)
+
+            result = _parse_extraction(used_prompt, content, prompt_cache_key, prompt_cache_retention, timeout)
 
         # Process results
-        result: ExtractionResult = response.output_parsed
-        json_output = result.model_dump_json(indent=2, by_alias=True, exclude_none=False)
+        json_output = dump_extraction_result(result)
         
-        # Save to files (attempt, but don't fail if it doesn't work)
-        base_dir = os.path.dirname(__file__)
-        save_extraction_results(json_output, base_dir)
+        # Save to S3 when configured, else to local files
+        # (attempt, but don't fail if it doesn't work)
+        if EXTRACTION_S3_BUCKET:
+            _save_extraction_to_s3(json_output, tempfile.gettempdir())
+        else:
+            save_extraction_results(json_output, _MODULE_DIR)
         
         return {
             "messages": [], 
@@ -403,8 +1101,7 @@ def run_extraction(prompt_id: Optional[str] = None, file_id: Optional[str] = Non
         }
         
     except Exception as e:
-        import traceback
-        error_details = f"Extraction failed: {str(e)}\n{traceback.format_exc()}"
+        error_details = _error_details("Extraction failed", e)
         print(f"DEBUG Error: {error_details}")
         return {
             "messages": [], 
@@ -414,20 +1111,159 @@ def run_extraction(prompt_id: Optional[str] = None, file_id: Optional[str] = Non
         }
 
 
+def render_and_extract(pdf_path: str, prompt_id: str, file_id: Optional[str] = None,
+                       dpi: int = 300, pages: Union[str, int, Iterable[int], None] = None,
+                       grayscale: bool = False, workers: Optional[int] = None,
+                       max_pending: int = 4, api_workers: int = 2) -> List[Dict[str, Any]]:
+    """
+    Render a PDF and run one extraction per page, overlapping the stages.
+    
+    Pages are uploaded and extracted as soon as each one is rendered, so the
+    network round-trips run while later pages are still being rasterized;
+    wall time is roughly the slowest stage instead of the sum of all three.
+    
+    Args:
+        pdf_path: Path to the input PDF file
+        prompt_id: OpenAI prompt ID (required: run_extraction ignores the
+            given file IDs when it falls back to its default prompt)
+        file_id: File ID of the already uploaded PDF; uploaded here if None
+        dpi, pages, grayscale, workers: As for render_pdf_to_images
+        max_pending: Rendered pages allowed to wait for upload/extraction
+            before rendering pauses (bounds the PNGs on disk at once; a
+            render pool can finish up to `workers` - 1 more)
+        api_workers: Threads uploading and extracting pages concurrently
+    
+    Returns:
+        One run_extraction result dict per page, in page order, each with
+        added "page", "image_path" and "image_id" keys
+    """
+    client = get_openai_client()
+
+    def _upload_once(path: str) -> str:
+        with open(path, "rb") as fh:
+            return client.files.create(file=(os.path.basename(path), fh), purpose="user_data").id
+
+    def _upload(path: str) -> str:
+        # The client has SDK retries off; back off here like the responses calls
+        return _with_retry(lambda: _upload_once(path))
+
+    def _extract_page(page_num: int, image_path: str) -> Dict[str, Any]:
+        image_id = None
+        try:
+            image_id = _upload(image_path)
+            result = run_extraction(prompt_id, pdf_file_id.result(), [image_id])
+        except Exception as e:
+            result = {"messages": [], "extraction_result": None, "json_output": None,
+                      "error": f"Page {page_num} failed: {e}"}
+        return {"page": page_num, "image_path": image_path, "image_id": image_id, **result}
+
+    # The PDF upload is submitted first, so it is running before any page
+    # task can wait on it
+    pending = threading.BoundedSemaphore(max_pending)
+    with ThreadPoolExecutor(max_workers=max(api_workers, 1)) as pool:
+        pdf_file_id = pool.submit(lambda: file_id or _upload(pdf_path))
+        futures = []
+        rendered = iter_render_pdf_to_images(pdf_path, dpi, pages, grayscale, workers)
+        while True:
+            # Take the slot before the next page is rendered, so at most
+            # max_pending rendered pages sit waiting at once
+            pending.acquire()
+            page = next(rendered, None)
+            if page is None:
+                pending.release()
+                break
+            page_num, image_path = page
+            future = pool.submit(_extract_page, page_num, image_path)
+            future.add_done_callback(lambda _: pending.release())
+            futures.append(future)
+        return [f.result() for f in futures]
+
+
+# Nodes of the extraction graph. Each returns only the state keys it sets;
+# "save" and "format" write different keys, so LangGraph runs them in the
+# same step without conflicting updates.
+async def _extract_node(state: ExtractionState) -> Dict[str, Any]:
+    result = await call_openai_extraction_async(state["prompt_id"], state["file_id"], state.get("image_ids"))
+    result.pop("messages", None)
+    return result
+
+
+async def _save_node(state: ExtractionState) -> Dict[str, Any]:
+    # Disk I/O runs on a worker thread so it does not block the event loop
+    paths = await asyncio.to_thread(save_extraction_results, state["json_output"], _MODULE_DIR)
+    return {"saved_paths": paths}
+
+
+async def _format_node(state: ExtractionState) -> Dict[str, Any]:
+    return {"summary": format_extraction_results(state["extraction_result"])}
+
+
+def _after_extract(state: ExtractionState):
+    # Fan out to the independent post-processing nodes, or stop on failure
+    return END if state.get("error") else ["save", "format"]
+
+
+@functools.lru_cache(maxsize=None)
+def build_extraction_graph():
+    """
+    Compile the async extraction workflow (built once per process).
+    
+    START -> extract -> {save, format} -> END: after the API call, saving
+    the files and formatting the summary run concurrently instead of one
+    after the other. New independent steps can be added to the fan-out.
+    """
+    graph = StateGraph(ExtractionState)
+    graph.add_node("extract", _extract_node)
+    graph.add_node("save", _save_node)
+    graph.add_node("format", _format_node)
+    graph.add_edge(START, "extract")
+    graph.add_conditional_edges("extract", _after_extract, ["save", "format", END])
+    graph.add_edge("save", END)
+    graph.add_edge("format", END)
+    return graph.compile()
+
+
+async def arun_extraction_graph(prompt_id: str, file_id: str,
+                                image_ids: Optional[List[str]] = None) -> ExtractionState:
+    """
+    Run one extraction through the async LangGraph workflow.
+    
+    Returns:
+        Final state with extraction_result/json_output (or error), plus
+        saved_paths and a formatted summary on success
+        
+    Example:
+        state = asyncio.run(arun_extraction_graph("pmpt_...", "file-..."))
+        print(state["summary"])
+    """
+    return await build_extraction_graph().ainvoke(
+        {"messages": [], "prompt_id": prompt_id, "file_id": file_id, "image_ids": image_ids}
+    )
+
+
 # ============================================================================
 # MODULE LOADING UTILITIES (for Lambda/dynamic execution)
 # ============================================================================
 
-def load_module_from_path(script_path: str, module_name: Optional[str] = None):
+# Modules already loaded by load_module_from_path, keyed by
+# (absolute path, module name, mtime). Warm Lambda containers then reuse the
+# loaded script instead of recompiling it and re-running its imports on every
+# invocation; editing the file changes its mtime and forces a reload.
+_module_cache: Dict[tuple, Any] = {}
+
+
+def load_module_from_path(script_path: str, module_name: Optional[str] = None, reload: bool = False):
     """
     Dynamically load a Python module from a file path.
     
     This function handles the importlib mechanics and proper module registration
     needed for tools like Pydantic and LangGraph that rely on module introspection.
+    Loaded modules are cached until the file changes.
     
     Args:
         script_path: Absolute or relative path to the Python file
         module_name: Name to register module under (uses filename if None)
+        reload: Load the file again even if a cached module is current
     
     Returns:
         The loaded module object
@@ -451,6 +1287,13 @@ def load_module_from_path(script_path: str, module_name: Optional[str] = None):
     if module_name is None:
         module_name = os.path.splitext(os.path.basename(script_path))[0]
     
+    cache_key = (script_path, module_name, os.path.getmtime(script_path))
+    if not reload and cache_key in _module_cache:
+        return _module_cache[cache_key]
+    
+    import importlib.util
+    from importlib.machinery import SourceFileLoader
+
     # Load using SourceFileLoader
     loader = SourceFileLoader(module_name, script_path)
     spec = importlib.util.spec_from_loader(loader.name, loader)
@@ -462,6 +1305,7 @@ def load_module_from_path(script_path: str, module_name: Optional[str] = None):
     # Execute the module (runs import-time code)
     loader.exec_module(module)
     
+    _module_cache[cache_key] = module
     return module
 
 
@@ -513,17 +1357,41 @@ def parse_lambda_payload(event: Dict[str, Any]) -> Dict[str, Any]:
         script = payload.get("script")
         prompt_id = payload.get("prompt_id")
     """
-    # Handle API Gateway proxy integration (body is JSON string)
     payload = event.get("body")
-    if isinstance(payload, str):
-        payload = json.loads(payload) if payload else {}
-    elif payload is None:
+    if isinstance(payload, dict):
+        # Already decoded (Lambda console/test events)
+        return payload
+    if isinstance(payload, (str, bytes, bytearray)):
+        # API Gateway proxy integration (body is a JSON string)
+        return orjson.loads(payload) if payload else {}
+    if payload is None:
         # Direct invocation - event itself contains the payload
-        payload = event
+        return event
     
     return payload
 
 
+def build_lambda_response(status_code: int, body: Any) -> Dict[str, Any]:
+    """
+    Build a Lambda/API Gateway response with a JSON body.
+    
+    Args:
+        status_code: HTTP status code
+        body: Either an already-serialized JSON string (passed through as-is,
+              avoiding a second escape pass) or a JSON-serializable object
+        
+    Returns:
+        Lambda response dictionary with statusCode, headers and body
+    """
+    if not isinstance(body, str):
+        body = orjson.dumps(body, default=str).decode()
+    return {
+        "statusCode": status_code,
+        "headers": {"Content-Type": "application/json"},
+        "body": body
+    }
+
+
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     AWS Lambda handler for running extraction scripts.
@@ -537,35 +1405,52 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             "prompt_id": "pmpt_...",
             "file_id": "file_...",
             "image_ids": ["file_img1", "file_img2"],
-            "dry_run": false
+            "dry_run": false,
+            "prompt_cache_key": "...",         (optional)
+            "prompt_cache_retention": "24h"    (optional)
         }
     
+    With "mode": "batch" the request is queued through the Batch API instead
+    (no script needed): either the single prompt_id/file_id/image_ids job
+    above or a "jobs" list of them. The response is then
+    {"status": "submitted", "batch_id": ...}; collect results with poll_batch.
+    
     Args:
         event: Lambda event (dict or API Gateway structure)
         context: Lambda runtime context (unused)
         
     Returns:
         Lambda response with statusCode and JSON body:
-        - 200: Success with extraction results
+        - 200: Success; a {"status": "success", "result": ...} envelope,
+          with the extraction's json_output spliced in as the result
         - 400: Bad request (missing script, no run_extraction function)  
         - 500: Internal error (exception during execution)
         
     Example Response:
         {
             "statusCode": 200,
-            "body": '{"status": "ok", "result": "..."}'
+            "headers": {"Content-Type": "application/json"},
+            "body": '{"status":"success","result":{"Inverter": [...], "Module": [...], ...}}'
         }
     """
     try:
         payload = parse_lambda_payload(event)
 
+        # Offline runs: queue the jobs at Batch API pricing and return at once
+        if payload.get("mode") == "batch":
+            jobs = payload.get("jobs") or [{
+                "prompt_id": payload.get("prompt_id"),
+                "file_id": payload.get("file_id"),
+                "image_ids": payload.get("image_ids", []),
+            }]
+            if not all(job.get("prompt_id") and job.get("file_id") for job in jobs):
+                return build_lambda_response(400, {"error": "batch jobs need prompt_id and file_id"})
+            return build_lambda_response(200, {"status": "submitted", "batch_id": run_extraction_batch_api(jobs)})
+
         # Extract and validate required fields
         script = payload.get("script")
         if not script:
-            return {
-                "statusCode": 400, 
-                "body": json.dumps({"error": "script parameter is required"})
-            }
+            return build_lambda_response(400, {"error": "script parameter is required"})
 
         # Extract optional parameters
         prompt_id = payload.get("prompt_id")
@@ -576,50 +1461,50 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         # Load and validate the extraction function
         run_extraction_func = load_run_extraction_function(script)
         if not run_extraction_func:
-            return {
-                "statusCode": 400, 
-                "body": json.dumps({
-                    "error": f"Script '{script}' does not expose run_extraction function"
-                })
-            }
+            return build_lambda_response(400, {
+                "error": f"Script '{script}' does not expose run_extraction function"
+            })
+
+        # Prompt-cache settings are only passed when the event sets them, so
+        # scripts whose run_extraction does not take them keep working
+        cache_options = {k: payload[k] for k in ("prompt_cache_key", "prompt_cache_retention") if payload.get(k)}
 
         # Execute the extraction
-        result = run_extraction_func(prompt_id, file_id, image_ids=image_ids, dry_run=dry_run)
+        result = run_extraction_func(prompt_id, file_id, image_ids=image_ids, dry_run=dry_run, **cache_options)
         
-        return {
-            "statusCode": 200, 
-            "body": json.dumps({
-                "status": "success", 
-                "result": str(result)
-            })
-        }
+        # Already-serialized extraction JSON is spliced into the envelope
+        # rather than decoded and re-encoded
+        if isinstance(result, dict) and isinstance(result.get("json_output"), str):
+            return build_lambda_response(200, '{"status":"success","result":' + result["json_output"] + "}")
+        
+        return build_lambda_response(200, {
+            "status": "success", 
+            "result": result
+        })
 
     except Exception as e:
         # Log error details (visible in CloudWatch in Lambda environment)
-        import traceback
-        error_msg = f"Lambda execution error: {str(e)}\n{traceback.format_exc()}"
-        print(error_msg)
+        print(_error_details("Lambda execution error", e))
         
-        return {
-            "statusCode": 500, 
-            "body": json.dumps({
-                "error": "Internal server error",
-                "details": str(e)
-            })
-        }
+        return build_lambda_response(500, {
+            "error": "Internal server error",
+            "details": str(e)
+        })
 
 
 # ============================================================================
 # CLI UTILITIES AND ARGUMENT PARSING
 # ============================================================================
 
-def create_extraction_cli_parser() -> argparse.ArgumentParser:
+def create_extraction_cli_parser() -> "argparse.ArgumentParser":
     """
     Create argument parser for extraction CLI commands.
     
     Returns:
         Configured ArgumentParser for extraction operations
     """
+    import argparse
+    
     parser = argparse.ArgumentParser(
         description="Run OpenAI equipment extraction on documents"
     )
@@ -634,13 +1519,15 @@ def create_extraction_cli_parser() -> argparse.ArgumentParser:
     return parser
 
 
-def create_lambda_cli_parser() -> argparse.ArgumentParser:
+def create_lambda_cli_parser() -> "argparse.ArgumentParser":
     """
     Create argument parser for Lambda wrapper CLI commands.
     
     Returns:
         Configured ArgumentParser for Lambda operations
     """
+    import argparse
+    
     parser = argparse.ArgumentParser(
         description="Lambda wrapper for dynamically loading and running extraction scripts"
     )
@@ -657,13 +1544,15 @@ def create_lambda_cli_parser() -> argparse.ArgumentParser:
     return parser
 
 
-def create_render_cli_parser() -> argparse.ArgumentParser:
+def create_render_cli_parser() -> "argparse.ArgumentParser":
     """
     Create argument parser for PDF rendering CLI commands.
     
     Returns:
         Configured ArgumentParser for PDF rendering operations
     """
+    import argparse
+    
     parser = argparse.ArgumentParser(
         description="Render PDF pages to PNG images"
     )
@@ -748,11 +1637,11 @@ def format_extraction_results(extraction_result: ExtractionResult) -> str:
         return "No extraction results available"
         
     lines = []
-    for equipment_type in ["Inverter", "Module", "Racking System"]:
-        field_name = equipment_type.lower().replace(" ", "_")
+    # The JSON aliases double as display labels ("Racking System", ...)
+    for field_name, equipment_type in _RESULT_FIELDS.items():
         equipment_list = getattr(extraction_result, field_name, None)
         
-        if equipment_list and len(equipment_list) > 0:
+        if equipment_list:
             equipment = equipment_list[0]
             lines.append(f"🔧 {equipment_type}:")
             lines.append(f"   Found: {equipment.found}")
@@ -771,10 +1660,29 @@ def format_extraction_results(extraction_result: ExtractionResult) -> str:
 # VALIDATION AND TESTING UTILITIES  
 # ============================================================================
 
+def _module_available(name: str) -> bool:
+    import importlib.util
+    return importlib.util.find_spec(name) is not None
+
+
+@functools.lru_cache(maxsize=1)
+def _environment_status() -> Dict[str, bool]:
+    return {
+        "openai_deps": EXTRACTION_DEPS_AVAILABLE,
+        "openai_key": bool(os.environ.get("OPENAI_API_KEY")),
+        # fitz is imported lazily, so probe for it without importing it
+        "pymupdf": _module_available("fitz"),
+    }
+
+
 def validate_environment() -> Dict[str, bool]:
     """
     Check if required dependencies and environment variables are available.
     
+    The environment does not change mid-process, so the checks run once and
+    each call returns a fresh copy of that result (safe to modify). Call
+    clear_environment_cache() after changing os.environ, e.g. in tests.
+    
     Returns:
         Dictionary with validation results for each requirement
         
@@ -783,11 +1691,12 @@ def validate_environment() -> Dict[str, bool]:
         if not status["openai_key"]:
             print("Warning: OPENAI_API_KEY not set")
     """
-    return {
-        "openai_deps": EXTRACTION_DEPS_AVAILABLE,
-        "openai_key": bool(os.environ.get("OPENAI_API_KEY")),
-        "pymupdf": True,  # If this imports, PyMuPDF is available
-    }
+    return dict(_environment_status())
+
+
+def clear_environment_cache() -> None:
+    """Forget the cached validate_environment() result."""
+    _environment_status.cache_clear()
 
 
 def run_extraction_test(use_defaults: bool = True) -> bool:
@@ -0,0 +1,140 @@
+"""Tests for the Lambda wrapper in scripts/lambda_call.py."""
+
+import importlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import textwrap
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+import lambda_call  # noqa: E402
+
+# Async target: reports the loop each invocation ran on, and fails if that
+# loop differs from (or outlived) the one its cached state was created on
+TARGET = textwrap.dedent('''
+    import asyncio
+
+    _loop = None
+
+    def run_extraction(prompt_id, file_id, image_ids=None, dry_run=False):
+        return {"status": "dry-run"}
+
+    async def run_extraction_many(jobs):
+        global _loop
+        loop = asyncio.get_running_loop()
+        if _loop is None:
+            _loop = loop
+        if loop is not _loop or _loop.is_closed():
+            raise RuntimeError("Event loop is closed")
+        return [{"file_id": job["file_id"], "loop": id(loop)} for job in jobs]
+''')
+
+
+
+def _write_target(test: unittest.TestCase, source: str) -> str:
+    # Outside the repo, under a module name unique to the test
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    path = os.path.join(directory.name, f"target_{test.id().rsplit('.', 1)[-1]}.py")
+    with open(path, "w") as f:
+        f.write(source)
+    return path
+
+
+class JobsInvocationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.script = _write_target(self, TARGET)
+
+    def _invoke(self):
+        event = {"script": self.script, "jobs": [{"file_id": "file-a"}, {"file_id": "file-b"}]}
+        response = lambda_call.lambda_handler(event, None)
+        self.assertEqual(response["statusCode"], 200, response["body"])
+        return json.loads(response["body"])
+
+    def test_warm_invocations_share_one_event_loop(self):
+        first = self._invoke()
+        second = self._invoke()
+        self.assertEqual([r["result"]["file_id"] for r in first["results"]], ["file-a", "file-b"])
+        self.assertEqual(first["results"][0]["result"]["loop"], second["results"][0]["result"]["loop"])
+
+
+# Sync target returning what run_extraction returns on success and on failure
+ENVELOPE_TARGET = textwrap.dedent('''
+    def _result(file_id):
+        if file_id == "file-bad":
+            return {"messages": [], "extraction_result": None, "json_output": None, "error": "boom"}
+        return {"messages": [], "extraction_result": object(), "json_output": '{"Inverter":null}'}
+
+    def run_extraction(prompt_id, file_id, image_ids=None, dry_run=False):
+        if dry_run:
+            return {"status": "dry-run", "file_id": file_id}
+        return _result(file_id)
+
+    def run_extraction_many(jobs):
+        return [_result(job["file_id"]) for job in jobs]
+''')
+
+
+class ResponseEnvelopeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.script = _write_target(self, ENVELOPE_TARGET)
+
+    def _body(self, **payload):
+        response = lambda_call.lambda_handler(dict(payload, script=self.script), None)
+        self.assertEqual(response["statusCode"], 200, response["body"])
+        return json.loads(response["body"])
+
+    def test_success_keeps_the_envelope(self):
+        self.assertEqual(self._body(file_id="file-a"), {"status": "ok", "result": {"Inverter": None}})
+
+    def test_dry_run_and_errors_share_the_envelope(self):
+        self.assertEqual(self._body(file_id="file-a", dry_run=True),
+                         {"status": "ok", "result": {"status": "dry-run", "file_id": "file-a"}})
+        body = self._body(file_id="file-bad")
+        self.assertEqual(body["status"], "ok")
+        self.assertEqual(body["result"]["error"], "boom")
+
+    def test_jobs_hold_one_envelope_per_job(self):
+        body = self._body(jobs=[{"file_id": "file-a"}, {"file_id": "file-bad"}])
+        self.assertEqual(body["status"], "ok")
+        self.assertEqual(body["results"][0], {"status": "ok", "result": {"Inverter": None}})
+        self.assertEqual(body["results"][1]["status"], "ok")
+        self.assertEqual(body["results"][1]["result"]["error"], "boom")
+
+
+
+class TargetFolderTest(unittest.TestCase):
+
+    def test_target_folder_goes_after_site_packages(self):
+        script = _write_target(self, TARGET)
+        directory = os.path.dirname(script)
+        self.addCleanup(lambda: directory in sys.path and sys.path.remove(directory))
+        lambda_call.lambda_handler({"script": script, "dry_run": True}, None)
+        self.assertEqual(sys.path[-1], directory)
+        site_packages = [i for i, p in enumerate(sys.path) if p.endswith("site-packages")]
+        self.assertTrue(site_packages)
+        self.assertGreater(sys.path.index(directory), max(site_packages))
+
+
+class LoggingConfigurationTest(unittest.TestCase):
+
+    def test_level_is_set_by_the_handler_not_the_import(self):
+        root = logging.getLogger()
+        self.addCleanup(root.setLevel, root.level)
+        root.setLevel(logging.CRITICAL)
+        with mock.patch.dict(os.environ, {"LOG_LEVEL": "DEBUG"}):
+            importlib.reload(lambda_call)
+        self.assertEqual(root.level, logging.CRITICAL)
+        lambda_call.lambda_handler({"dry_run": True}, None)
+        self.assertEqual(root.level, logging.DEBUG)
+
+if __name__ == "__main__":
+    unittest.main()
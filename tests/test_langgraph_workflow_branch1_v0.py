@@ -0,0 +1,24 @@
+"""Tests for scripts/Script_Archive/langgraph_workflow_branch1_v0.py."""
+
+import importlib
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts", "Script_Archive"))
+
+
+class ApiKeyCheckTest(unittest.TestCase):
+
+    def test_imports_without_a_key_and_fails_on_the_call(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("OPENAI_API_KEY", None)
+            workflow = importlib.import_module("langgraph_workflow_branch1_v0")
+            with self.assertRaisesRegex(RuntimeError, "OPENAI_API_KEY"):
+                workflow.call_llm({"messages": []})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Tests for the shared OpenAI clients (scripts/_openai_client.py and src/utils.py)."""
+
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import _openai_client  # noqa: E402
+import utils  # noqa: E402
+
+
+async def _current_client(get):
+    # Two lookups inside one loop must agree
+    first = get()
+    assert get() is first
+    return first
+
+
+@mock.patch.dict(os.environ, {"OPENAI_API_KEY": "sk-test"})
+class AsyncClientPerLoopTest(unittest.TestCase):
+
+    def test_scripts_client_is_rebuilt_for_each_asyncio_run(self):
+        a = asyncio.run(_current_client(_openai_client.get_async_client))
+        b = asyncio.run(_current_client(_openai_client.get_async_client))
+        self.assertIsNot(a, b)
+
+    def test_scripts_run_async_reuses_one_loop_and_client(self):
+        a = _openai_client.run_async(_current_client(_openai_client.get_async_client))
+        b = _openai_client.run_async(_current_client(_openai_client.get_async_client))
+        self.assertIs(a, b)
+        # Outside a loop the background loop's client is handed out
+        self.assertIs(_openai_client.get_async_client(), a)
+
+    def test_utils_client_is_rebuilt_for_each_asyncio_run(self):
+        a = asyncio.run(_current_client(utils.get_async_openai_client))
+        b = asyncio.run(_current_client(utils.get_async_openai_client))
+        self.assertIsNot(a, b)
+
+    def test_utils_client_requires_a_running_loop(self):
+        with self.assertRaises(RuntimeError):
+            utils.get_async_openai_client()
+
+
+
+class StrictTextFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        _openai_client.strict_text_format.cache_clear()
+        self.addCleanup(_openai_client.strict_text_format.cache_clear)
+
+    def test_matches_what_text_format_sends(self):
+        from openai.lib._parsing._responses import type_to_text_format_param
+        self.assertEqual(_openai_client.strict_text_format(utils.ExtractionResult),
+                         {"format": type_to_text_format_param(utils.ExtractionResult)})
+
+    def test_untested_major_version_warns(self):
+        with mock.patch("openai.__version__", "2.0.0"), self.assertWarns(RuntimeWarning):
+            _openai_client.strict_text_format(utils.ExtractionResult)
+
+    def test_moved_helper_fails_clearly(self):
+        with mock.patch.dict(sys.modules, {"openai.lib._pydantic": None}), \
+                self.assertRaisesRegex(RuntimeError, "to_strict_json_schema"):
+            _openai_client.strict_text_format(utils.ExtractionResult)
+
+
+if __name__ == "__main__":
+    unittest.main()
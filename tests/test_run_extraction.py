@@ -0,0 +1,397 @@
+"""Tests for scripts/run_extraction.py against a stub OpenAI transport."""
+
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import httpx
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+import run_extraction  # noqa: E402
+
+RESULT = {
+    "Inverter": [{"found": True, "manufacturer": "SolarEdge", "model": "SE7600H", "evidence_note": "label"}],
+    "Module": [{"found": True, "manufacturer": "REC", "model": "REC400AA", "evidence_note": None}],
+    "Racking System": None,
+}
+CONTENT = [{"type": "input_file", "file_id": "file-pdf"}]
+
+
+def _sse(*events) -> bytes:
+    return b"".join(f"event: {e['type']}\ndata: {json.dumps(e)}\n\n".encode() for e in events)
+
+
+def _completed_stream(text: str) -> bytes:
+    response = {
+        "id": "resp_1", "object": "response", "created_at": 0, "status": "completed", "model": "stub",
+        "output": [{"type": "message", "id": "msg_1", "role": "assistant", "status": "completed",
+                    "content": [{"type": "output_text", "text": text, "annotations": []}]}],
+    }
+    return _sse(
+        {"type": "response.created", "sequence_number": 0, "response": dict(response, status="in_progress", output=[])},
+        {"type": "response.output_text.delta", "sequence_number": 1, "item_id": "msg_1",
+         "output_index": 0, "content_index": 0, "delta": text, "logprobs": []},
+        {"type": "response.completed", "sequence_number": 2, "response": response},
+    )
+
+
+class _Stalled(httpx.AsyncByteStream):
+    # Headers are sent, then nothing ever follows
+    async def __aiter__(self):
+        await asyncio.sleep(3600)
+        yield b""
+
+
+class StubTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.responses = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(json.loads(request.content))
+            status, body = self.responses.pop(0)
+            if body == "stall-before-headers":
+                await asyncio.sleep(3600)
+            if body == "stall-after-headers":
+                return httpx.Response(status, headers={"content-type": "text/event-stream"}, stream=_Stalled())
+            return httpx.Response(status, headers={"content-type": "text/event-stream"}, content=body)
+
+        client = AsyncOpenAI(api_key="sk-test", base_url="http://stub/v1", max_retries=0,
+                             http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        patcher = mock.patch.object(run_extraction, "get_async_client", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_streams_prompt_without_model(self):
+        self.responses.append((200, _completed_stream(json.dumps(RESULT))))
+        deltas = []
+        result = run_extraction._parse_response("pmpt_1", CONTENT, on_delta=deltas.append)
+
+        self.assertEqual(result.inverter[0].model, "SE7600H")
+        self.assertIsNone(result.racking_system)
+        self.assertEqual("".join(deltas), json.dumps(RESULT))
+        body = self.requests[0]
+        self.assertTrue(body["stream"])
+        self.assertNotIn("model", body)
+        self.assertEqual(body["prompt"], {"id": "pmpt_1"})
+        self.assertEqual(body["text"]["format"]["type"], "json_schema")
+        self.assertEqual(body["text"]["format"]["name"], "ExtractionResult")
+        self.assertTrue(body["text"]["format"]["strict"])
+        self.assertEqual(set(body["text"]["format"]["schema"]["properties"]), {"Inverter", "Module", "Racking System"})
+
+    def test_retries_rate_limits(self):
+        self.responses.append((429, b'{"error": {"message": "slow down", "type": "rate_limit"}}'))
+        self.responses.append((200, _completed_stream(json.dumps(RESULT))))
+        with mock.patch.object(run_extraction.time, "sleep") as sleep:
+            result = run_extraction._parse_response("pmpt_1", CONTENT)
+        self.assertEqual(result.module[0].manufacturer, "REC")
+        self.assertEqual(len(self.requests), 2)
+        sleep.assert_called_once()
+
+    def test_gives_up_after_max_retries_with_growing_backoff(self):
+        for _ in range(3):
+            self.responses.append((429, b'{"error": {"message": "slow down", "type": "rate_limit"}}'))
+        with mock.patch.object(run_extraction.time, "sleep") as sleep, \
+                mock.patch.object(run_extraction.random, "random", return_value=0.5):
+            with self.assertRaises(openai.RateLimitError):
+                run_extraction._parse_response("pmpt_1", CONTENT, max_retries=2)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [1.5, 2.5])
+
+    def test_client_errors_are_not_retried(self):
+        self.responses.append((400, b'{"error": {"message": "bad prompt", "type": "invalid_request_error"}}'))
+        with mock.patch.object(run_extraction.time, "sleep") as sleep:
+            with self.assertRaises(openai.BadRequestError):
+                run_extraction._parse_response("pmpt_1", CONTENT)
+        self.assertEqual(len(self.requests), 1)
+        sleep.assert_not_called()
+
+    def test_first_event_timeout_after_headers(self):
+        self.responses.append((200, "stall-after-headers"))
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            run_extraction._parse_response("pmpt_1", CONTENT, max_retries=0, first_token_timeout=0.3)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_first_event_timeout_before_headers(self):
+        self.responses.append((200, "stall-before-headers"))
+        self.responses.append((200, _completed_stream(json.dumps(RESULT))))
+        with mock.patch.object(run_extraction.time, "sleep"):
+            result = run_extraction._parse_response("pmpt_1", CONTENT, max_retries=1, first_token_timeout=0.3)
+        self.assertEqual(result.inverter[0].manufacturer, "SolarEdge")
+
+    def test_failed_response_is_not_retried(self):
+        failed = {"id": "resp_1", "object": "response", "created_at": 0, "status": "failed", "model": "stub",
+                  "output": [], "error": {"code": "server_error", "message": "boom"}}
+        self.responses.append((200, _sse({"type": "response.failed", "sequence_number": 0, "response": failed})))
+        with self.assertRaisesRegex(RuntimeError, "failed"):
+            run_extraction._parse_response("pmpt_1", CONTENT)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_multi_splits_groups_the_api_rejects(self):
+        def respond(body):
+            markers = [p for p in body["input"][0]["content"] if p["type"] == "input_text"]
+            if len(markers) > 2:
+                # Pretend three documents overflow the context window
+                return 400, b'{"error": {"message": "context_length_exceeded"}}'
+            if markers:
+                return 200, _completed_stream(json.dumps({"results": [RESULT] * len(markers)}))
+            return 200, _completed_stream(json.dumps(RESULT))
+
+        self.responses = _Responder(respond, self.requests)
+        items = [{"file_id": f"file-{i}"} for i in range(3)]
+        out = run_extraction.run_extraction_multi(items, prompt_id="pmpt_1", use_cache=False)
+
+        self.assertEqual(len(out["results"]), 3)
+        self.assertTrue(all(r["extraction_result"].inverter[0].model == "SE7600H" for r in out["results"]))
+        # One rejected 3-document call, then a single and a 2-document call
+        self.assertEqual([sum(p["type"] == "input_file" for p in r["input"][0]["content"]) for r in self.requests],
+                         [3, 1, 2])
+
+
+class EscalationTest(unittest.TestCase):
+
+    def setUp(self):
+        # Same stub transport, without re-running StubTransportTest's tests
+        StubTransportTest.setUp(self)
+        patcher = mock.patch.object(run_extraction, "_writer")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _extract(self, *results, **kwargs):
+        for result in results:
+            self.responses.append((200, _completed_stream(json.dumps(result))))
+        deltas = []
+        out = run_extraction.run_extraction("pmpt_1", "file-a", ["file-img"], use_cache=False,
+                                            on_delta=deltas.append, **kwargs)
+        self.assertNotIn("error", out)
+        return out, deltas
+
+    def test_default_keeps_the_prompt_settings(self):
+        out, deltas = self._extract(RESULT)
+        self.assertEqual(len(self.requests), 1)
+        self.assertNotIn("reasoning", self.requests[0])
+        self.assertTrue(all("detail" not in part for part in self.requests[0]["input"][0]["content"]))
+        self.assertEqual("".join(deltas), json.dumps(RESULT))
+
+    def test_nothing_found_is_not_escalated(self):
+        nothing = {name: [{"found": False, "manufacturer": None, "model": None, "evidence_note": None}]
+                   for name in RESULT}
+        out, deltas = self._extract(nothing, effort="medium")
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.requests[0]["reasoning"], {"effort": "medium"})
+        self.assertFalse(out["extraction_result"].inverter[0].found)
+        self.assertEqual(deltas, [out["json_output"]])
+
+    def test_unsure_result_is_escalated_and_only_the_final_pass_streamed(self):
+        unsure = dict(RESULT, Inverter=[{"found": True, "manufacturer": "SolarEdge", "model": None,
+                                         "evidence_note": "model number illegible"}])
+        out, deltas = self._extract(unsure, RESULT, effort="medium")
+        self.assertEqual([r["reasoning"]["effort"] for r in self.requests], ["medium", "high"])
+        self.assertEqual([r["input"][0]["content"][1]["detail"] for r in self.requests], ["low", "high"])
+        self.assertEqual(out["extraction_result"].inverter[0].model, "SE7600H")
+        self.assertEqual("".join(deltas), json.dumps(RESULT))
+
+
+class _Responder:
+    # Stands in for the response queue: builds each response from the request
+    def __init__(self, respond, requests):
+        self.respond, self.requests = respond, requests
+
+    def pop(self, _):
+        return self.respond(self.requests[-1])
+
+
+class SyncBatchApiTest(unittest.TestCase):
+
+    def test_submit_and_poll(self):
+        uploaded = []
+        response = {"id": "resp_1", "object": "response", "created_at": 0, "status": "completed", "model": "stub",
+                    "output": [{"type": "message", "id": "m", "role": "assistant", "status": "completed",
+                                "content": [{"type": "output_text", "text": json.dumps(RESULT), "annotations": []}]}]}
+        batch = {"id": "batch_1", "object": "batch", "endpoint": "/v1/responses", "completion_window": "24h",
+                 "created_at": 0, "input_file_id": "file-in", "status": "completed", "output_file_id": "file-out"}
+        output = "\n".join([json.dumps({"custom_id": "0", "response": {"status_code": 200, "body": response}}),
+                            json.dumps({"custom_id": "1", "response": None})])
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            path = request.url.path
+            if path == "/v1/files":
+                uploaded.append(request.read())
+                return httpx.Response(200, json={"id": "file-in", "object": "file", "bytes": 1, "created_at": 0,
+                                                 "filename": "x", "purpose": "batch", "status": "processed"})
+            if path in ("/v1/batches", "/v1/batches/batch_1"):
+                return httpx.Response(200, json=batch)
+            if path == "/v1/files/file-out/content":
+                return httpx.Response(200, text=output)
+            return httpx.Response(404, json={"error": {"message": path}})
+
+        client = OpenAI(api_key="sk-test", base_url="http://stub/v1", max_retries=0,
+                        http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+        with mock.patch.object(run_extraction, "get_client", return_value=client):
+            batch_id = run_extraction.submit_batch([{"file_id": "file-a"}, {"file_id": "file-b", "image_ids": ["file-i"]}])
+            results = dict(run_extraction.poll_batch(batch_id))
+
+        self.assertEqual(batch_id, "batch_1")
+        self.assertIn(b'"file_id": "file-i"', uploaded[0])
+        self.assertIn(b'"url": "/v1/responses"', uploaded[0])
+        self.assertEqual(results["0"].module[0].model, "REC400AA")
+        self.assertIsNone(results["1"])
+
+
+    def test_error_file_and_invalid_lines_yield_none(self):
+        def body(text):
+            return {"id": "resp_1", "object": "response", "created_at": 0, "status": "completed", "model": "stub",
+                    "output": [{"type": "message", "id": "m", "role": "assistant", "status": "completed",
+                                "content": [{"type": "output_text", "text": text, "annotations": []}]}]}
+
+        batch = {"id": "batch_1", "object": "batch", "endpoint": "/v1/responses", "completion_window": "24h",
+                 "created_at": 0, "input_file_id": "file-in", "status": "completed",
+                 "output_file_id": "file-out", "error_file_id": "file-err"}
+        files = {
+            # A result that does not match the schema comes first, so the
+            # later lines are only seen if it does not end the generator
+            "file-out": [{"custom_id": "bad", "response": {"status_code": 200, "body": body('{"Inverter": 1}')}},
+                         {"custom_id": "good", "response": {"status_code": 200, "body": body(json.dumps(RESULT))}}],
+            "file-err": [{"custom_id": "failed", "response": {"status_code": 400, "body": {
+                "error": {"message": "Invalid file", "type": "invalid_request_error"}}}}],
+        }
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            path = request.url.path
+            if path == "/v1/batches/batch_1":
+                return httpx.Response(200, json=batch)
+            file_id = path.split("/")[3]
+            return httpx.Response(200, text="\n".join(json.dumps(line) for line in files[file_id]))
+
+        client = OpenAI(api_key="sk-test", base_url="http://stub/v1", max_retries=0,
+                        http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+        with mock.patch.object(run_extraction, "get_client", return_value=client), \
+                self.assertLogs(run_extraction.logger, "WARNING"):
+            results = dict(run_extraction.poll_batch("batch_1"))
+
+        self.assertEqual(set(results), {"bad", "good", "failed"})
+        self.assertIsNone(results["bad"])
+        self.assertIsNone(results["failed"])
+        self.assertEqual(results["good"].inverter[0].model, "SE7600H")
+
+class CacheKeyTest(unittest.TestCase):
+
+    def test_key_covers_effort_roles_order_and_detail(self):
+        pdf = {"type": "input_file", "file_id": "file-a"}
+        img = {"type": "input_image", "file_id": "file-b"}
+        base = run_extraction._cache_key("pmpt_1", [pdf, img], "medium")
+        self.assertEqual(base, run_extraction._cache_key("pmpt_1", [dict(pdf), dict(img)], "medium"))
+        self.assertNotEqual(base, run_extraction._cache_key("pmpt_1", [pdf, img], "high"))
+        self.assertNotEqual(base, run_extraction._cache_key("pmpt_2", [pdf, img], "medium"))
+        self.assertNotEqual(base, run_extraction._cache_key("pmpt_1", [img, pdf], "medium"))
+        swapped = [{"type": "input_image", "file_id": "file-a"}, {"type": "input_file", "file_id": "file-b"}]
+        self.assertNotEqual(base, run_extraction._cache_key("pmpt_1", swapped, "medium"))
+        self.assertNotEqual(base, run_extraction._cache_key("pmpt_1", [pdf, dict(img, detail="high")], "medium"))
+
+    def test_high_effort_is_not_answered_from_medium_cache(self):
+        db = sqlite3.connect(":memory:", check_same_thread=False)
+        db.execute("CREATE TABLE c(k TEXT PRIMARY KEY, v BLOB)")
+        parsed = run_extraction.ExtractionResult.model_validate(RESULT)
+        with mock.patch.object(run_extraction, "_cache", db), \
+                mock.patch.object(run_extraction, "_writer"), \
+                mock.patch.object(run_extraction, "_adaptive_parse", return_value=parsed) as parse:
+            first = run_extraction.run_extraction("pmpt_1", "file-a", effort="medium", use_cache=True)
+            again = run_extraction.run_extraction("pmpt_1", "file-a", effort="medium", use_cache=True)
+            high = run_extraction.run_extraction("pmpt_1", "file-a", effort="high", use_cache=True)
+        self.assertNotIn("cached", first)
+        self.assertTrue(again["cached"])
+        self.assertNotIn("cached", high)
+        self.assertEqual([c.args[3] for c in parse.call_args_list], ["medium", "high"])
+
+    def _cache_db(self):
+        db = sqlite3.connect(":memory:", check_same_thread=False)
+        db.execute("CREATE TABLE c(k TEXT PRIMARY KEY, v BLOB)")
+        patcher = mock.patch.object(run_extraction, "_cache", db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return db
+
+    def test_cache_is_off_by_default(self):
+        db = self._cache_db()
+        parsed = run_extraction.ExtractionResult.model_validate(RESULT)
+        with mock.patch.object(run_extraction, "CACHE_ENABLED", False), \
+                mock.patch.object(run_extraction, "_writer"), \
+                mock.patch.object(run_extraction, "_adaptive_parse", return_value=parsed) as parse:
+            run_extraction.run_extraction("pmpt_1", "file-a")
+            again = run_extraction.run_extraction("pmpt_1", "file-a")
+        self.assertNotIn("cached", again)
+        self.assertEqual(parse.call_count, 2)
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM c").fetchone()[0], 0)
+
+    def test_call_modes_do_not_share_entries(self):
+        self._cache_db()
+        parsed = run_extraction.ExtractionResult.model_validate(RESULT)
+        with mock.patch.object(run_extraction, "_writer"), \
+                mock.patch.object(run_extraction, "_adaptive_parse", return_value=parsed), \
+                mock.patch.object(run_extraction, "_extract_group",
+                                  side_effect=lambda prompt, items: [{"extraction_result": parsed,
+                                                                      "json_output": "{}"}] * len(items)) as group:
+            run_extraction.run_extraction("pmpt_1", "file-a", use_cache=True)
+            multi = run_extraction.run_extraction_multi([{"file_id": "file-a"}], prompt_id="pmpt_1", use_cache=True)
+            again = run_extraction.run_extraction_multi([{"file_id": "file-a"}], prompt_id="pmpt_1", use_cache=True)
+        # A single-document result does not answer a packed multi call, but a
+        # repeated multi call is served from its own entry
+        self.assertNotIn("cached", multi["results"][0])
+        self.assertTrue(again["results"][0]["cached"])
+        self.assertEqual(group.call_count, 1)
+
+    def test_graph_path_keys_on_the_content_it_sends(self):
+        _, content = run_extraction._build_request("pmpt_1", "file-a", ["", "file-b"])
+        graph = run_extraction._graph_content("file-a", ["", "file-b"])
+        self.assertNotEqual(content, graph)
+        self.assertEqual(run_extraction._cache_key("pmpt_1", graph, mode="graph"),
+                         run_extraction._cache_key("pmpt_1", list(graph), mode="graph"))
+        self.assertNotEqual(run_extraction._cache_key("pmpt_1", content),
+                            run_extraction._cache_key("pmpt_1", content, mode="async"))
+
+
+class SaveOutputsTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name, value in (("OUTPUT_DIR", directory),
+                            ("OUTPUT_LOG", os.path.join(directory, "extracted_fields.jsonl")),
+                            ("OUTPUT_LATEST", os.path.join(directory, "extracted_fields.json"))):
+            patcher = mock.patch.object(run_extraction, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.directory = directory
+
+    def test_writes_timestamped_latest_and_history(self):
+        first = run_extraction.ExtractionResult.model_validate(RESULT)
+        second = run_extraction.ExtractionResult.model_validate(dict(RESULT, Module=None))
+        with mock.patch.object(run_extraction, "_utc_timestamp", return_value="2023-11-20T15-30-45Z"):
+            paths = [run_extraction._save_outputs(r, run_extraction.dump_result(r)) for r in (first, second)]
+
+        self.assertEqual([os.path.basename(p) for p in paths],
+                         ["extracted_fields-2023-11-20T15-30-45Z.json", "extracted_fields-2023-11-20T15-30-45Z-1.json"])
+        with open(paths[0], encoding="utf-8") as f:
+            self.assertEqual(json.load(f), RESULT)
+        with open(os.path.join(self.directory, "extracted_fields.json"), encoding="utf-8") as f:
+            self.assertIsNone(json.load(f)["Module"])
+        with open(os.path.join(self.directory, "extracted_fields.jsonl"), encoding="utf-8") as f:
+            self.assertEqual(len(f.read().splitlines()), 2)
+        self.assertEqual([n for n in os.listdir(self.directory) if n.endswith(".tmp")], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Tests for scripts/Script_Archive/run_extraction_v0.py."""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts", "Script_Archive"))
+
+import run_extraction_v0  # noqa: E402
+
+
+def _fake_run_extraction(prompt_id, file_id, image_ids=None, dry_run=False):
+    if file_id == "file-bad":
+        raise ValueError("boom")
+    return {"file_id": file_id}
+
+
+class RunExtractionManyTest(unittest.TestCase):
+
+    def test_failed_job_does_not_lose_the_batch(self):
+        jobs = [{"prompt_id": "pmpt_1", "file_id": f} for f in ("file-a", "file-bad", "file-c")]
+        with mock.patch.object(run_extraction_v0, "run_extraction", _fake_run_extraction):
+            results = run_extraction_v0.run_extraction_many(jobs, max_workers=2)
+
+        self.assertEqual(results[0], {"file_id": "file-a"})
+        self.assertIsNone(results[1]["extraction_result"])
+        self.assertIn("boom", results[1]["error"])
+        self.assertEqual(results[2], {"file_id": "file-c"})
+
+
+
+def _parsed(prompt=None, input=None, text_format=None):
+    # Answers documents out of order, tagged with their numbers
+    n = len(input) - 1
+    results = [{"document": i, "result": {"Inverter": [{"found": True, "model": f"M{i}"}]}}
+               for i in reversed(range(1, n + 1))]
+    return mock.Mock(output_parsed=text_format.model_validate({"results": results}))
+
+
+class RunExtractionBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.responses.parse.side_effect = _parsed
+        patcher = mock.patch.object(run_extraction_v0, "get_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_no_items_make_no_call(self):
+        self.assertEqual(run_extraction_v0.run_extraction_batch("pmpt_1", []), {"results": []})
+        self.client.responses.parse.assert_not_called()
+
+    def test_results_are_matched_by_document_number(self):
+        items = [{"file_id": f"file-{i}"} for i in range(1, 4)]
+        out = run_extraction_v0.run_extraction_batch("pmpt_1", items)
+
+        self.assertEqual([r["extraction_result"].inverter[0].model for r in out["results"]], ["M1", "M2", "M3"])
+        messages = self.client.responses.parse.call_args.kwargs["input"]
+        self.assertIn("document order", messages[0]["content"][0]["text"])
+        self.assertEqual(messages[1]["content"][0]["text"], "Document 1 of 3")
+
+    def test_missing_document_numbers_are_an_error(self):
+        def duplicated(**kwargs):
+            results = [{"document": 1, "result": {}}, {"document": 1, "result": {}}]
+            return mock.Mock(output_parsed=kwargs["text_format"].model_validate({"results": results}))
+
+        self.client.responses.parse.side_effect = duplicated
+        out = run_extraction_v0.run_extraction_batch("pmpt_1", [{"file_id": "file-a"}, {"file_id": "file-b"}])
+        self.assertIsNone(out["results"])
+        self.assertIn("documents 1-2", out["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,505 @@
+"""Tests for src/utils.py."""
+
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import httpx  # noqa: E402
+import openai  # noqa: E402
+from openai import AsyncOpenAI, OpenAI  # noqa: E402
+
+import utils  # noqa: E402
+
+
+def _stub_client(handler) -> OpenAI:
+    # Same settings as get_openai_client(): SDK retries off
+    return OpenAI(api_key="sk-test", base_url="http://stub/v1", max_retries=0,
+                  http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+
+
+def _stub_async_client(handler) -> AsyncOpenAI:
+    return AsyncOpenAI(api_key="sk-test", base_url="http://stub/v1", max_retries=0,
+                       http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+
+RESULT = {
+    "Inverter": [{"found": True, "manufacturer": "Enphase", "model": "IQ8PLUS", "evidence_note": "legend"}],
+    "Module": None,
+    "Racking System": [{"found": False, "manufacturer": None, "model": None, "evidence_note": None}],
+}
+
+
+def _response_object(text: str) -> dict:
+    return {
+        "id": "resp_1", "object": "response", "created_at": 0, "status": "completed", "model": "stub",
+        "output": [{"type": "message", "id": "msg_1", "role": "assistant", "status": "completed",
+                    "content": [{"type": "output_text", "text": text, "annotations": []}]}],
+        "parallel_tool_calls": False, "tool_choice": "auto", "tools": [],
+    }
+
+
+def _file_object(file_id: str, purpose: str = "user_data") -> dict:
+    return {"id": file_id, "object": "file", "bytes": 1, "created_at": 0, "filename": "x",
+            "purpose": purpose, "status": "processed"}
+
+
+class _FakeDoc(list):
+    def close(self):
+        pass
+
+
+class RenderPagesTest(unittest.TestCase):
+    # Rasterization is faked, so no PDF backend is needed: these cover how
+    # pages are dispatched
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.pdf = os.path.join(self.directory, "doc.pdf")
+        with open(self.pdf, "wb") as f:
+            f.write(b"%PDF")
+        self.rendered = []
+
+        def render(doc, page_num, zoom, grayscale, output_path):
+            self.rendered.append(page_num)
+            return output_path
+
+        for name, value in (("_get_cached_pdf", lambda path: _FakeDoc([None] * 3)),
+                            ("_render_page_to_png", render)):
+            patcher = mock.patch.object(utils, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_renders_in_process_by_default(self):
+        with mock.patch("multiprocessing.Pool") as pool:
+            paths = utils.render_pdf_to_images(self.pdf)
+        pool.assert_not_called()
+        self.assertEqual(self.rendered, [1, 2, 3])
+        self.assertEqual([os.path.basename(p) for p in paths], ["doc_p01.png", "doc_p02.png", "doc_p03.png"])
+
+    def test_falls_back_when_no_pool_can_be_created(self):
+        # What multiprocessing raises on AWS Lambda, which has no /dev/shm
+        with mock.patch("multiprocessing.Pool", side_effect=OSError(38, "Function not implemented")) as pool:
+            paths = utils.render_pdf_to_images(self.pdf, workers=4)
+        pool.assert_called_once()
+        self.assertEqual(self.rendered, [1, 2, 3])
+        self.assertEqual(len(paths), 3)
+
+
+class _FakePool:
+    # Records which pages have been sent to the pool but not collected yet
+    def __init__(self, *args, **kwargs):
+        self.in_flight, self.peak = set(), 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def apply_async(self, func, args):
+        page_num, output_path = args[0][0], args[0][3]
+        self.in_flight.add(page_num)
+        self.peak = max(self.peak, len(self.in_flight))
+        result = mock.Mock()
+        result.get = lambda: self.in_flight.discard(page_num) or output_path
+        return result
+
+
+class RenderWindowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.pdf = os.path.join(self.directory, "doc.pdf")
+        with open(self.pdf, "wb") as f:
+            f.write(b"%PDF")
+        patcher = mock.patch.object(utils, "_get_cached_pdf", lambda path: _FakeDoc([None] * 10))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pool_runs_at_most_workers_pages_ahead(self):
+        pool = _FakePool()
+        with mock.patch("multiprocessing.Pool", return_value=pool):
+            pages = utils.iter_render_pdf_to_images(self.pdf, workers=3)
+            first = next(pages)
+            self.assertEqual(first[0], 1)
+            # Page 1 handed over; only pages 2-3 have been dispatched since
+            self.assertEqual(pool.in_flight, {2, 3})
+            rest = list(pages)
+        self.assertEqual([first[0]] + [n for n, _ in rest], list(range(1, 11)))
+        self.assertEqual(pool.peak, 3)
+
+    def test_render_and_extract_pauses_rendering_when_pending_is_full(self):
+        lock = threading.Lock()
+        waiting, peak = [0], [0]
+
+        def render(*args):
+            for page_num in range(1, 9):
+                with lock:
+                    waiting[0] += 1
+                    peak[0] = max(peak[0], waiting[0])
+                yield page_num, os.path.join(self.directory, f"doc_p{page_num:02d}.png")
+
+        def extract(prompt_id, file_id, image_ids):
+            time.sleep(0.01)
+            with lock:
+                waiting[0] -= 1
+            return {"messages": [], "extraction_result": None, "json_output": "{}"}
+
+        client = _stub_client(lambda request: httpx.Response(200, json=_file_object("file-1")))
+        with mock.patch.object(utils, "get_openai_client", return_value=client), \
+                mock.patch.object(utils, "iter_render_pdf_to_images", render), \
+                mock.patch.object(utils, "_with_retry", lambda call: "file-1"), \
+                mock.patch.object(utils, "run_extraction", extract):
+            results = utils.render_and_extract(self.pdf, "pmpt_1", max_pending=2, api_workers=4)
+
+        self.assertEqual([r["page"] for r in results], list(range(1, 9)))
+        self.assertLessEqual(peak[0], 2)
+
+
+class SaveExtractionResultsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_concurrent_saves_keep_every_result(self):
+        outputs = [json.dumps({"n": i}) for i in range(40)]
+        # Freeze the clock so every save lands in the same second
+        with mock.patch.object(utils, "_utc_timestamp", return_value="2023-11-20T15-30-45Z"), \
+                ThreadPoolExecutor(max_workers=8) as pool:
+            paths = list(pool.map(lambda out: utils.save_extraction_results(out, self.directory), outputs))
+
+        self.assertTrue(all(p for p in paths), "a save failed")
+        timestamped = [p["timestamped"] for p in paths]
+        self.assertEqual(len(set(timestamped)), len(outputs))
+        self.assertIn(os.path.join(self.directory, "extracted_fields-2023-11-20T15-30-45Z.json"), timestamped)
+        saved = set()
+        for path in timestamped:
+            with open(path, encoding="utf-8") as f:
+                saved.add(f.read())
+        self.assertEqual(saved, set(outputs))
+
+        with open(os.path.join(self.directory, "extracted_fields.json"), encoding="utf-8") as f:
+            self.assertIn(f.read(), outputs)
+        self.assertEqual([name for name in os.listdir(self.directory) if name.endswith(".tmp")], [])
+
+    def test_copies_when_hard_links_are_unsupported(self):
+        with mock.patch.object(utils.os, "link", side_effect=OSError("no links")):
+            paths = utils.save_extraction_results('{"a": 1}', self.directory)
+        with open(paths["latest"], encoding="utf-8") as f:
+            self.assertEqual(f.read(), '{"a": 1}')
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(["extracted_fields.json", os.path.basename(paths["timestamped"])]))
+
+
+class S3SaveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.boto3 = mock.Mock()
+        self.put_object = self.boto3.client.return_value.put_object
+        for patcher in (mock.patch.object(utils, "EXTRACTION_S3_BUCKET", "bucket"),
+                        mock.patch.object(utils, "_s3_client", None),
+                        mock.patch.object(utils.tempfile, "tempdir", self.directory),
+                        mock.patch.dict(sys.modules, {"boto3": self.boto3}),
+                        mock.patch.object(utils, "_parse_extraction",
+                                          return_value=utils.ExtractionResult.model_validate(RESULT))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_upload_finishes_before_run_extraction_returns(self):
+        result = utils.run_extraction("pmpt_1", "file-pdf")
+        self.put_object.assert_called_once()
+        kwargs = self.put_object.call_args.kwargs
+        self.assertEqual(kwargs["Bucket"], "bucket")
+        self.assertTrue(kwargs["Key"].startswith(utils.EXTRACTION_S3_PREFIX))
+        self.assertEqual(kwargs["Body"], result["json_output"].encode("utf-8"))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_failed_upload_is_saved_to_the_temp_directory(self):
+        self.put_object.side_effect = RuntimeError("access denied")
+        with mock.patch.object(utils, "save_extraction_results",
+                               wraps=utils.save_extraction_results) as save:
+            result = utils.run_extraction("pmpt_1", "file-pdf")
+        save.assert_called_once_with(result["json_output"], self.directory)
+        with open(os.path.join(self.directory, "extracted_fields.json"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), result["json_output"])
+
+
+class LambdaHandlerTest(unittest.TestCase):
+
+    def _body(self, result):
+        with mock.patch.object(utils, "load_run_extraction_function", return_value=lambda *a, **k: result):
+            response = utils.lambda_handler({"script": "target.py", "file_id": "file-a"}, None)
+        self.assertEqual(response["statusCode"], 200, response["body"])
+        return json.loads(response["body"])
+
+    def test_extraction_json_is_spliced_into_the_envelope(self):
+        body = self._body({"messages": [], "extraction_result": object(), "json_output": '{"Module":null}'})
+        self.assertEqual(body, {"status": "success", "result": {"Module": None}})
+
+    def test_dry_run_uses_the_same_envelope(self):
+        self.assertEqual(self._body({"status": "dry-run"}), {"status": "success", "result": {"status": "dry-run"}})
+
+
+class ValidateEnvironmentTest(unittest.TestCase):
+
+    def setUp(self):
+        utils.clear_environment_cache()
+        self.addCleanup(utils.clear_environment_cache)
+
+    def test_pymupdf_is_probed(self):
+        with mock.patch("importlib.util.find_spec", return_value=None):
+            self.assertFalse(utils.validate_environment()["pymupdf"])
+        utils.clear_environment_cache()
+        with mock.patch("importlib.util.find_spec", return_value=object()):
+            self.assertTrue(utils.validate_environment()["pymupdf"])
+
+    def test_callers_get_their_own_copy(self):
+        status = utils.validate_environment()
+        status["openai_key"] = "tampered"
+        self.assertIsInstance(utils.validate_environment()["openai_key"], bool)
+
+    def test_cache_clear_picks_up_environment_changes(self):
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": ""}):
+            self.assertFalse(utils.validate_environment()["openai_key"])
+            os.environ["OPENAI_API_KEY"] = "sk-test"
+            self.assertFalse(utils.validate_environment()["openai_key"])
+            utils.clear_environment_cache()
+            self.assertTrue(utils.validate_environment()["openai_key"])
+
+
+class RenderAndExtractUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.pdf = os.path.join(self.directory, "doc.pdf")
+        self.png = os.path.join(self.directory, "doc_page1.png")
+        for path in (self.pdf, self.png):
+            with open(path, "wb") as f:
+                f.write(b"data")
+
+    def test_uploads_are_retried(self):
+        uploads = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            uploads.append(request.url.path)
+            # Every file's first attempt fails with a 500
+            if len(uploads) % 2:
+                return httpx.Response(500, json={"error": {"message": "try again"}})
+            return httpx.Response(200, json=_file_object(f"file-{len(uploads)}"))
+
+        extracted = {"messages": [], "extraction_result": None, "json_output": "{}"}
+        with mock.patch.object(utils, "get_openai_client", return_value=_stub_client(handler)), \
+                mock.patch.object(utils, "iter_render_pdf_to_images", return_value=iter([(1, self.png)])), \
+                mock.patch.object(utils, "run_extraction", return_value=extracted) as run, \
+                mock.patch.object(utils.time, "sleep"):
+            results = utils.render_and_extract(self.pdf, "pmpt_1", api_workers=1)
+
+        self.assertEqual(uploads, ["/v1/files"] * 4)
+        self.assertEqual(len(results), 1)
+        self.assertNotIn("error", results[0])
+        self.assertEqual(results[0]["image_id"], "file-4")
+        run.assert_called_once_with("pmpt_1", "file-2", ["file-4"])
+
+
+class RetryTest(unittest.TestCase):
+
+    def _run(self, *responses):
+        requests = []
+        queue = list(responses)
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(json.loads(request.content))
+            return queue.pop(0)
+
+        with mock.patch.object(utils, "get_openai_client", return_value=_stub_client(handler)), \
+                mock.patch.object(utils.time, "sleep") as sleep:
+            try:
+                return utils._parse_with_retry(prompt={"id": "pmpt_1"}, input=[],
+                                               text_format=utils.ExtractionResult), requests, sleep
+            except Exception as e:
+                e.requests, e.sleep = requests, sleep
+                raise
+
+    def test_retries_with_retry_after(self):
+        response, requests, sleep = self._run(
+            httpx.Response(429, headers={"retry-after": "2"}, json={"error": {"message": "slow down"}}),
+            httpx.Response(503, json={"error": {"message": "busy"}}),
+            httpx.Response(200, json=_response_object(json.dumps(RESULT))),
+        )
+        self.assertEqual(response.output_parsed.inverter[0].model, "IQ8PLUS")
+        self.assertEqual(len(requests), 3)
+        self.assertNotIn("model", requests[0])
+        delays = [c.args[0] for c in sleep.call_args_list]
+        self.assertEqual(delays[0], 2.0)
+        self.assertLessEqual(delays[1], utils.RETRY_BASE_DELAY * 2)
+
+    def test_client_errors_fail_at_once(self):
+        with self.assertRaises(openai.BadRequestError) as ctx:
+            self._run(httpx.Response(400, json={"error": {"message": "bad prompt"}}))
+        self.assertEqual(len(ctx.exception.requests), 1)
+        ctx.exception.sleep.assert_not_called()
+
+    def test_gives_up_after_max_tries(self):
+        with mock.patch.object(utils, "RETRY_MAX_TRIES", 3), self.assertRaises(openai.RateLimitError) as ctx:
+            self._run(*[httpx.Response(429, json={"error": {"message": "slow down"}})] * 3)
+        self.assertEqual(len(ctx.exception.requests), 3)
+
+    def test_delay_is_capped_and_jittered(self):
+        for attempt in range(12):
+            self.assertLessEqual(utils._retry_delay(Exception(), attempt), utils.RETRY_MAX_DELAY)
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name, value in (("EXTRACTION_CACHE_ENABLED", True),
+                            ("EXTRACTION_CACHE_DB", os.path.join(directory, "cache.db")),
+                            ("_cache_db", None)):
+            patcher = mock.patch.object(utils, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_repeated_request_is_served_from_cache(self):
+        calls = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            calls.append(request)
+            return httpx.Response(200, json=_response_object(json.dumps(RESULT)))
+
+        content = utils._build_content("file-pdf", ["file-img"])
+        with mock.patch.object(utils, "get_openai_client", return_value=_stub_client(handler)):
+            fresh = utils._parse_extraction("pmpt_1", content)
+            cached = utils._parse_extraction("pmpt_1", content)
+            other = utils._parse_extraction("pmpt_2", content)
+
+        self.assertEqual(len(calls), 2)
+        self.assertIsInstance(cached, utils.ExtractionResult)
+        self.assertEqual(utils.dump_extraction_result(cached), utils.dump_extraction_result(fresh))
+        self.assertEqual(cached.racking_system[0].found, False)
+        self.assertIsNone(cached.module)
+        self.assertEqual(utils.dump_extraction_result(other), utils.dump_extraction_result(fresh))
+
+
+class PromptCacheOptionsTest(unittest.TestCase):
+
+    def test_retention_is_not_sent_by_default(self):
+        with mock.patch.object(utils, "PROMPT_CACHE_RETENTION", ""):
+            self.assertEqual(utils._prompt_cache_options("pmpt_1"), {"prompt_cache_key": "pmpt_1"})
+            self.assertEqual(utils._prompt_cache_options("pmpt_1", sdk=False), {"prompt_cache_key": "pmpt_1"})
+
+    def test_retention_when_configured(self):
+        with mock.patch.object(utils, "PROMPT_CACHE_RETENTION", "24h"):
+            self.assertEqual(utils._prompt_cache_options("pmpt_1", "key"),
+                             {"prompt_cache_key": "key", "extra_body": {"prompt_cache_retention": "24h"}})
+        self.assertEqual(utils._prompt_cache_options("pmpt_1", prompt_cache_retention="24h", sdk=False),
+                         {"prompt_cache_key": "pmpt_1", "prompt_cache_retention": "24h"})
+
+
+class BatchApiTest(unittest.TestCase):
+
+    def test_submit_and_poll(self):
+        uploaded = []
+        lines = [
+            {"custom_id": "a", "response": {"status_code": 200, "body": _response_object(json.dumps(RESULT))}},
+            {"custom_id": "b", "response": None, "error": {"code": "failed"}},
+            # Does not match the schema; must not hide the lines after it
+            {"custom_id": "c", "response": {"status_code": 200, "body": _response_object('{"Module": 1}')}},
+            {"custom_id": "d", "response": {"status_code": 200, "body": _response_object(json.dumps(RESULT))}},
+        ]
+        errors = [{"custom_id": "e", "response": {"status_code": 400, "body": {
+            "error": {"message": "Invalid file", "type": "invalid_request_error"}}}}]
+        statuses = ["in_progress", "completed"]
+
+        def batch_object(status: str) -> dict:
+            done = status == "completed"
+            return {"id": "batch_1", "object": "batch", "endpoint": "/v1/responses", "completion_window": "24h",
+                    "created_at": 0, "input_file_id": "file-in", "status": status,
+                    "output_file_id": "file-out" if done else None, "error_file_id": "file-err" if done else None}
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            path = request.url.path
+            if request.method == "POST" and path == "/v1/files":
+                uploaded.append(request.read())
+                return httpx.Response(200, json=_file_object("file-in", "batch"))
+            if request.method == "POST" and path == "/v1/batches":
+                self.assertEqual(json.loads(request.content)["input_file_id"], "file-in")
+                return httpx.Response(200, json=batch_object("validating"))
+            if path == "/v1/batches/batch_1":
+                return httpx.Response(200, json=batch_object(statuses.pop(0)))
+            if path == "/v1/files/file-out/content":
+                return httpx.Response(200, text="\n".join(json.dumps(line) for line in lines))
+            if path == "/v1/files/file-err/content":
+                return httpx.Response(200, text="\n".join(json.dumps(line) for line in errors))
+            return httpx.Response(404, json={"error": {"message": path}})
+
+        jobs = [{"prompt_id": "pmpt_1", "file_id": "file-a", "custom_id": "a"},
+                {"prompt_id": "pmpt_1", "file_id": "file-b", "image_ids": ["file-img"], "custom_id": "b"}]
+        with mock.patch.object(utils, "get_openai_client", return_value=_stub_client(handler)), \
+                mock.patch.object(utils.time, "sleep") as sleep:
+            batch_id = utils.run_extraction_batch_api(jobs)
+            results = utils.poll_batch(batch_id, interval=5)
+
+        self.assertEqual(batch_id, "batch_1")
+        body = uploaded[0]
+        for expected in (b'"custom_id": "a"', b'"file_id": "file-img"', b'"strict": true',
+                         b'"prompt_cache_key": "pmpt_1"'):
+            self.assertIn(expected, body)
+        sleep.assert_called_once_with(5)
+        self.assertEqual(set(results), {"a", "b", "c", "d", "e"})
+        self.assertEqual(results["a"].inverter[0].manufacturer, "Enphase")
+        self.assertEqual(results["d"].inverter[0].manufacturer, "Enphase")
+        for failed in ("b", "c", "e"):
+            self.assertIsNone(results[failed])
+
+
+class AsyncBatchTest(unittest.TestCase):
+
+    def test_concurrency_is_bounded_and_order_kept(self):
+        in_flight = []
+        peak = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            file_id = json.loads(request.content)["input"][0]["content"][0]["file_id"]
+            in_flight.append(file_id)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(file_id)
+            if file_id == "file-bad":
+                return httpx.Response(400, json={"error": {"message": "bad file"}})
+            return httpx.Response(200, json=_response_object(json.dumps(RESULT)))
+
+        async def run():
+            client = _stub_async_client(handler)
+            with mock.patch.object(utils, "get_async_openai_client", return_value=client):
+                return await utils.run_extraction_batch(
+                    [{"prompt_id": "pmpt_1", "file_id": f"file-{i}"} for i in range(5)]
+                    + [{"prompt_id": "pmpt_1", "file_id": "file-bad"}], concurrency=2)
+
+        results = asyncio.run(run())
+        self.assertEqual(len(results), 6)
+        self.assertLessEqual(max(peak), 2)
+        self.assertTrue(all(r["extraction_result"] is not None for r in results[:5]))
+        self.assertIn("bad file", results[5]["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()